@@ -0,0 +1,379 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+# directory of the project modules, imported by the measures of the import cost from any working directory
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# rows of the shipped datasets, scale factor 1
+MARKETING_ROWS = 2240
+CLICK_ROWS = 2000
+
+
+def make_marketing(n, seed=0):
+    """
+    This function returns a synthetic raw marketing campaign DataFrame of `n` rows with the schema of
+    `datasets/marketing_campaign.xlsx` (about 1% duplicated rows and 1% missing incomes, like the original).
+    """
+    rng = np.random.default_rng(seed)
+
+    df = pd.DataFrame({
+        'ID': np.arange(n),
+        'Year_Birth': rng.integers(1940, 1997, n),
+        'Education': rng.choice(['Graduation', 'PhD', 'Master', 'Basic', '2n Cycle'], n, p=[0.5, 0.22, 0.17, 0.02, 0.09]),
+        'Marital_Status': rng.choice(['Single', 'Together', 'Married', 'Divorced', 'Widow', 'Alone', 'Absurd', 'YOLO'], n,
+                                     p=[0.21, 0.26, 0.386, 0.1, 0.034, 0.005, 0.003, 0.002]),
+        'Income': rng.normal(52000, 21000, n).clip(1700, 170000).round(),
+        'Kidhome': rng.integers(0, 3, n),
+        'Teenhome': rng.integers(0, 3, n),
+        'Dt_Customer': (pd.Timestamp('2012-07-30') + pd.to_timedelta(rng.integers(0, 700, n), unit='D')).strftime('%Y-%m-%d'),
+        'Recency': rng.integers(0, 100, n),
+        'MntWines': rng.integers(0, 1500, n),
+        'MntFruits': rng.integers(0, 200, n),
+        'MntMeatProducts': rng.integers(0, 1700, n),
+        'MntFishProducts': rng.integers(0, 260, n),
+        'MntSweetProducts': rng.integers(0, 260, n),
+        'MntGoldProds': rng.integers(0, 360, n),
+        'NumDealsPurchases': rng.integers(0, 16, n),
+        'NumWebPurchases': rng.integers(0, 28, n),
+        'NumCatalogPurchases': rng.integers(0, 29, n),
+        'NumStorePurchases': rng.integers(0, 14, n),
+        'NumWebVisitsMonth': rng.integers(0, 21, n),
+        'AcceptedCmp3': rng.integers(0, 2, n),
+        'AcceptedCmp4': rng.integers(0, 2, n),
+        'AcceptedCmp5': rng.integers(0, 2, n),
+        'AcceptedCmp1': rng.integers(0, 2, n),
+        'AcceptedCmp2': rng.integers(0, 2, n),
+        'Complain': rng.integers(0, 2, n),
+        'Z_CostContact': 3,
+        'Z_Revenue': 11,
+        'Response': rng.integers(0, 2, n),
+    })
+
+    # missing incomes and duplicated rows
+    df.loc[rng.random(n) < 0.01, 'Income'] = np.nan
+    duplicates = rng.random(n) < 0.01
+    df.loc[duplicates, df.columns[1:]] = df.loc[np.roll(duplicates, -1), df.columns[1:]].to_numpy()
+    df.loc[duplicates, 'ID'] = df['ID'].to_numpy()[np.roll(duplicates, -1)]
+
+    return df
+
+def make_click(n, seed=0):
+    """
+    This function returns a synthetic raw ads clicking DataFrame of `n` rows with the schema of `datasets/adsclicking.csv`.
+    """
+    rng = np.random.default_rng(seed)
+
+    return pd.DataFrame({
+        'Unnamed: 0': np.arange(n),
+        'Age': rng.integers(18, 65, n),
+        'Gender': rng.choice(['Female', 'Male'], n),
+        'Income': rng.integers(20000, 100000, n),
+        'Location': rng.choice(['Rural', 'Suburban', 'Urban'], n),
+        'Device': rng.choice(['Desktop', 'Mobile', 'Tablet'], n),
+        'Interest_Category': rng.choice(['Fashion', 'Sports', 'Technology', 'Travel'], n),
+        'Time_Spent_on_Site': rng.uniform(10, 120, n),
+        'Number_of_Pages_Viewed': rng.integers(1, 20, n),
+        'Click': rng.integers(0, 2, n),
+    })
+
+def make_product(seed=0):
+    """
+    This function returns a synthetic raw sheet with the layout of `datasets/consumers.xls`
+    (80 rows, relative figures of Ambos sexos / Varones / Mujeres at rows 37-44, 46-53 and 55-62).
+    """
+    rng = np.random.default_rng(seed)
+    labels = ['Total', 'De 16 a 24 años', 'De 25 a 34 años', 'De 35 a 44 años', 'De 45 a 54 años',
+              'De 55 a 64 años', 'De 65 a 74 años', 'De 75 y más años']
+
+    # start with an empty sheet of object columns, like the parsed workbook
+    df = pd.DataFrame(np.full((80, 13), np.nan, dtype=object), columns=['Hábitos de vida'] + [f'Unnamed: {i}' for i in range(1, 13)])
+
+    # fill the three relative blocks with percentages that add up to 100
+    df.iloc[35, 0] = 'CIFRAS RELATIVAS'
+    for header, start in (('Ambos sexos', 37), ('Varones', 46), ('Mujeres', 55)):
+        df.iloc[start - 1, 0] = header
+        for i, label in enumerate(labels):
+            shares = rng.dirichlet(np.ones(5)) * 100
+            df.iloc[start + i, 0] = '        ' + label
+            df.iloc[start + i, 1:7] = [100.0] + list(shares.round(2))
+
+    return df
+
+def marketing_cases():
+    """
+    This function returns the benchmark cases of the marketing dataset, as a dict name -> (setup, run).
+    """
+    import functions_marketing as marketing
+    from functions_regression import ols_band, ols_stats_chunks
+    from functions_segment import fit_segments
+
+    def cleaned(n):
+        return marketing.clean_df_marketing(make_marketing(n))
+
+    def income_range(n):
+        # the customers drawn by the income charts
+        df = cleaned(n)
+        return df[(df['Income'] < 110000) & (df['Income'] > 15000)]
+
+    def income_line(df):
+        # the data of the line of purchases_by_income_line: the sufficient statistics and the band over the incomes
+        stats = ols_stats_chunks([df])
+        return ols_band(stats, np.linspace(stats[6], stats[7], 100))
+
+    # each repeat runs on a fresh copy of the frame, so the memoized aggregations are computed every time
+    return {
+        'clean_df_marketing': (make_marketing, marketing.clean_df_marketing),
+        'site_purchases_by_age': (cleaned, marketing.site_purchases_by_age_data),
+        'site_purchases_by_income': (cleaned, marketing.site_purchases_by_income_data),
+        'web_visits_by_age': (cleaned, marketing.web_visits_by_age_data),
+        'income_by_ages': (cleaned, marketing.income_by_ages_data),
+        'purchases_by_income': (cleaned, lambda df: df[(df['Income'] < 110000) & (df['Income'] > 15000)][['Income', 'MntWines']]),
+        'purchases_by_income_density': (income_range, marketing.income_density),
+        'purchases_by_income_line': (income_range, income_line),
+        'purchases_by_education': (cleaned, marketing.purchases_by_education_data),
+        'son_at_home': (cleaned, marketing.son_at_home_data),
+        'purchases_by_living_status': (cleaned, marketing.purchases_by_living_status_data),
+        'purchases_by_month': (cleaned, marketing.purchases_by_month_data),
+        'fit_segments': (cleaned, lambda df: fit_segments([df])),
+    }
+
+def click_cases():
+    """
+    This function returns the benchmark cases of the ads clicking dataset, as a dict name -> (setup, run).
+    """
+    import functions_click as click
+
+    def cleaned(n):
+        return click.clean_df_click(make_click(n))
+
+    return {
+        'clean_df_click': (make_click, click.clean_df_click),
+        'click_cube': (cleaned, click.click_cube),
+        'click_by_category': (cleaned, click.click_by_category_data),
+        'click_by_category_income': (cleaned, click.click_by_category_income_data),
+        'click_by_category_age': (cleaned, click.click_by_category_age_data),
+    }
+
+def product_cases():
+    """
+    This function returns the benchmark cases of the consumers survey. The sheet has a fixed size, so scale
+    factor `n` means `n` sheets, as a dict name -> (setup, run).
+    """
+    import functions_product as product
+
+    def sheets(n):
+        return [make_product(seed=i % 16) for i in range(n)]
+
+    def cleaned(n):
+        return [product.clean_df_product(sheet) for sheet in sheets(n)]
+
+    def totals(frames):
+        # the data behind consume_wine, consume_m_w_by_age, consume_men_women and consume_by_age
+        for df_both, df_men, df_women in frames:
+            product.consume_wine_data(df_both)
+            product.consume_m_w_by_age_data(df_men, df_women)
+            product.consume_men_women_data(df_men, df_women)
+            product.consume_by_age_data(df_both)
+
+    return {
+        'clean_df_product': (sheets, lambda frames: [product.clean_df_product(sheet) for sheet in frames]),
+        'consume_aggregates': (cleaned, totals),
+    }
+
+# benchmark cases by dataset, with the rows of the dataset at scale factor 1
+DATASETS = {
+    'marketing': (marketing_cases, MARKETING_ROWS),
+    'click': (click_cases, CLICK_ROWS),
+    'product': (product_cases, 1),
+}
+
+def peak_rss_mb():
+    """
+    This function returns the peak resident memory of the current process in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+def run_case(args):
+    """
+    This function runs one benchmark case (`dataset`, `case`, `scale`, `repeat`) and returns its measures.
+    It is meant to run in a fresh process, so the peak RSS belongs to the case.
+    """
+    dataset, case, scale, repeat = args
+    cases, base_rows = DATASETS[dataset]
+    setup, run = cases()[case]
+
+    # build the input outside of the timing
+    rows = base_rows * scale
+    data = setup(rows if dataset != 'product' else scale)
+    rss_before = peak_rss_mb()
+
+    # keep the best of the repeats, each on a fresh copy of the input (the cleaners modify it)
+    seconds = []
+    for _ in range(repeat):
+        copy = data.copy() if hasattr(data, 'copy') else data
+        start = time.perf_counter()
+        run(copy)
+        seconds.append(time.perf_counter() - start)
+
+    best = min(seconds)
+    rows_done = rows if dataset != 'product' else 80 * scale
+    return {
+        'dataset': dataset,
+        'case': case,
+        'scale': scale,
+        'rows': rows_done,
+        'seconds': best,
+        'rows_per_sec': rows_done / best if best > 0 else float('inf'),
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_rss_delta_mb': peak_rss_mb() - rss_before,
+    }
+
+def run_benchmarks(scales=(1, 10, 100), datasets=None, cases=None, repeat=3):
+    """
+    This function runs every benchmark case of `datasets` (all by default, optionally only `cases`)
+    at every scale factor of `scales`, each in a fresh process, and returns the results as a dict
+    with the environment (`meta`) and the list of measures (`results`).
+    """
+    jobs = []
+    for dataset in datasets or DATASETS:
+        for case in DATASETS[dataset][0]():
+            if cases is None or case in cases:
+                jobs.extend((dataset, case, scale, repeat) for scale in scales)
+
+    # a fresh process per case, so the measures do not depend on the previous cases
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for job in jobs:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(run_case, job).result()
+        print(f"{result['dataset']:>9} {result['case']:<28} x{result['scale']:<5} {result['seconds']:9.4f}s "
+              f"{result['rows_per_sec']:>14,.0f} rows/s {result['peak_rss_mb']:8.1f} MB", flush=True)
+        results.append(result)
+
+    meta = {
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+    }
+    return {'meta': meta, 'results': results}
+
+# modules whose import cost is measured, pandas alone is the floor
+IMPORT_MODULES = ['pandas', 'functions_marketing', 'functions_click', 'functions_product', 'functions_render']
+
+# heavy optional libraries that the modules only import when a function needs them
+LAZY_LIBRARIES = ['matplotlib', 'seaborn', 'openpyxl', 'scipy']
+
+def import_cost(module):
+    """
+    This function imports `module` in a fresh interpreter and returns the import time in seconds, the peak
+    resident memory in MB and whether each of `LAZY_LIBRARIES` was loaded by the import.
+    """
+    code = ('import sys, time, resource\n'
+            'start = time.perf_counter()\n'
+            f'import {module}\n'
+            'seconds = time.perf_counter() - start\n'
+            'peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n'
+            f'print(seconds, peak, *[library in sys.modules for library in {LAZY_LIBRARIES!r}])')
+    output = subprocess.run([sys.executable, '-c', code], cwd=PROJECT_DIR, capture_output=True, text=True,
+                            check=True).stdout.split()
+    peak = float(output[1])
+
+    return {
+        'module': module,
+        'import_seconds': float(output[0]),
+        'peak_rss_mb': peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024,
+        **{library: loaded == 'True' for library, loaded in zip(LAZY_LIBRARIES, output[2:])},
+    }
+
+def import_module(module):
+    """
+    This function imports `module` (from the project directory first) and returns the peak resident memory of the
+    process in MB, the task of `spawn_cost`.
+    """
+    if PROJECT_DIR not in sys.path:
+        sys.path.insert(0, PROJECT_DIR)
+    __import__(module)
+    return peak_rss_mb()
+
+def spawn_cost(module):
+    """
+    This function returns the seconds from starting a spawned worker process to getting the result of a task
+    that imports `module` in it, the cost paid by every worker of `run_benchmarks` or `functions_dag.run_dag`.
+    """
+    context = multiprocessing.get_context('spawn')
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        pool.submit(import_module, module).result()
+    return time.perf_counter() - start
+
+def run_import_costs(modules=IMPORT_MODULES):
+    """
+    This function measures the import cost (see `import_cost`) and the spawn cost (see `spawn_cost`) of every
+    module of `modules` and returns them as a pandas DataFrame.
+    """
+    rows = []
+    for module in modules:
+        row = import_cost(module)
+        row['spawn_seconds'] = spawn_cost(module)
+        rows.append(row)
+    return pd.DataFrame(rows).set_index('module')
+
+def compare_results(results, baseline, threshold=0.2):
+    """
+    This function compares the `results` of `run_benchmarks` with a stored `baseline` (same format) and returns
+    a DataFrame with the time ratio of each case and scale, flagging as regressions the ratios above 1 + `threshold`.
+    """
+    current = pd.DataFrame(results['results']).set_index(['dataset', 'case', 'scale'])
+    previous = pd.DataFrame(baseline['results']).set_index(['dataset', 'case', 'scale'])
+
+    # join the cases measured in both runs
+    report = current[['seconds', 'peak_rss_mb']].join(previous[['seconds', 'peak_rss_mb']], rsuffix='_baseline', how='inner')
+    report['ratio'] = report['seconds'] / report['seconds_baseline']
+    report['regression'] = report['ratio'] > 1 + threshold
+
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the cleaning and aggregation functions on synthetic data.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100], help='scale factors of the shipped datasets (e.g. 1 10 100 1000)')
+    parser.add_argument('--datasets', nargs='+', choices=list(DATASETS), help='datasets to benchmark (all by default)')
+    parser.add_argument('--cases', nargs='+', help='cases to run (all by default)')
+    parser.add_argument('--repeat', type=int, default=3, help='repeats of each case, the best time is kept')
+    parser.add_argument('--output', default='benchmark_results.json', help='file of the results')
+    parser.add_argument('--baseline', help='results file to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown ratio above which a case is a regression')
+    parser.add_argument('--imports', action='store_true', help='measure the import and worker spawn cost of the modules instead')
+    args = parser.parse_args()
+
+    if args.imports:
+        print(run_import_costs().to_string(float_format='{:.3f}'.format))
+        sys.exit(0)
+
+    results = run_benchmarks(args.scales, args.datasets, args.cases, args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results written to {args.output}')
+
+    # compare with the baseline and fail on regressions
+    if args.baseline:
+        with open(args.baseline) as f:
+            report = compare_results(results, json.load(f), args.threshold)
+        print(report.to_string())
+        if report['regression'].any():
+            print(f"{report['regression'].sum()} regression(s) above {args.threshold:.0%}")
+            sys.exit(1)
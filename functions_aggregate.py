@@ -0,0 +1,122 @@
+import weakref
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from functions_trace import traced
+
+# maximum number of (frame, key) results kept by group_stats
+CACHE_SIZE = 64
+
+# results of group_stats, least recently used first, each entry is removed when its frame is collected
+AGGREGATE_CACHE = OrderedDict()
+
+
+def buffer_address(series):
+    """
+    This function returns the identity of the values of the pandas Series `series`: the address of the numpy
+    buffer of a numpy column or of the codes of a categorical one, the identity of the array of other columns.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.array.codes.__array_interface__['data'][0]
+    if isinstance(series.dtype, np.dtype):
+        return series.to_numpy().__array_interface__['data'][0]
+    return id(series.array)
+
+def frame_fingerprint(df):
+    """
+    This function returns a cheap fingerprint of the pandas DataFrame `df`: its identity, its length, its columns
+    and the identity of the values of every column (see `buffer_address`), which changes when a column is replaced
+    (e.g. `df['MntWines'] = df['MntWines'] * 2`). Hashing the content would cost more than the aggregations it
+    saves, so values written in place (e.g. with `df.loc`) are not seen: call `clear_aggregate_cache` after such
+    writes.
+    """
+    return (id(df), len(df), tuple(df.columns), tuple(df.dtypes.astype(str)),
+            tuple(buffer_address(df[column]) for column in df.columns))
+
+def clear_aggregate_cache():
+    """
+    This function empties the cache of `group_stats`.
+    """
+    for entry in AGGREGATE_CACHE.values():
+        entry[1].detach()
+    AGGREGATE_CACHE.clear()
+
+def group_codes(series):
+    """
+    This function returns the group code of each row of `series` (-1 for missing values) and the groups:
+    all the categories for a categorical Series (like `observed=False`), the sorted distinct values otherwise.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(), pd.CategoricalIndex(series.cat.categories, categories=series.cat.categories,
+                                                                 ordered=series.cat.ordered, name=series.name)
+
+    codes, uniques = pd.factorize(series, sort=True)
+    return codes, pd.Index(uniques, name=series.name)
+
+def group_stats(df, key):
+    """
+    This function takes a pandas DataFrame (`df`) and computes, for every group of the column `key`, the sum and the
+    count of non-missing values of every numeric column, in one pass over the group codes per column.
+    Results are memoized by frame and key (see `frame_fingerprint`) with LRU eviction, so all the charts grouping
+    the same frame by the same key share one scan. The cache does not keep the frames alive, the results of a frame
+    are removed when it is collected.
+    Returns a dict with the 'sum' and 'count' DataFrames and the 'size' Series (rows), indexed by the groups.
+    """
+    cache_key = (frame_fingerprint(df), key)
+
+    # serve the result from the cache while the frame is alive
+    entry = AGGREGATE_CACHE.get(cache_key)
+    if entry is not None and entry[0]() is df:
+        AGGREGATE_CACHE.move_to_end(cache_key)
+        return entry[2]
+
+    # get the group of each row, rows without a group are left out
+    codes, groups = group_codes(df[key])
+    in_group = codes >= 0
+
+    # sum and count the numeric columns of each group
+    sums, counts = {}, {}
+    for column in df.columns:
+        if column == key or not (pd.api.types.is_numeric_dtype(df[column]) or pd.api.types.is_bool_dtype(df[column])):
+            continue
+        values = df[column].to_numpy(dtype='float64', na_value=np.nan)
+        valid = in_group & ~np.isnan(values)
+        sums[column] = np.bincount(codes[valid], weights=values[valid], minlength=len(groups))
+        counts[column] = np.bincount(codes[valid], minlength=len(groups))
+
+    stats = {
+        'sum': pd.DataFrame(sums, index=groups),
+        'count': pd.DataFrame(counts, index=groups),
+        'size': pd.Series(np.bincount(codes[in_group], minlength=len(groups)), index=groups),
+    }
+
+    # keep the result until the frame is collected, dropping the least recently used ones
+    AGGREGATE_CACHE[cache_key] = (weakref.ref(df), weakref.finalize(df, AGGREGATE_CACHE.pop, cache_key, None), stats)
+    while len(AGGREGATE_CACHE) > CACHE_SIZE:
+        AGGREGATE_CACHE.popitem(last=False)[1][1].detach()
+
+    return stats
+
+@traced('aggregate')
+def group_aggregate(df, key, measures, how='mean', observed=False):
+    """
+    This function takes a pandas DataFrame (`df`) and returns the `how` ('mean', 'sum' or 'count') of each column
+    of `measures` (a column name or a list) for every group of `key`, like `df.groupby(key, observed=observed)[measures].agg(how)`.
+    It reads from the memoized `group_stats`, or from one SQL query when `df` is a `functions_sql.SqlFrame`.
+    """
+    stats = group_stats(df, key) if isinstance(df, pd.DataFrame) else df.group_stats(key, measures)
+
+    if how == 'mean':
+        result = stats['sum'][measures] / stats['count'][measures].replace(0, np.nan)
+    elif how in ('sum', 'count'):
+        result = stats[how][measures]
+    else:
+        raise ValueError(f"Unknown aggregation: {how!r}, expected 'mean', 'sum' or 'count'")
+
+    # leave out the categories without rows
+    if observed:
+        result = result[stats['size'].to_numpy() > 0]
+        if isinstance(result.index, pd.CategoricalIndex):
+            result.index = result.index.remove_unused_categories()
+
+    return result
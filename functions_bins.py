@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+
+class BinScheme:
+    """
+    A named and versioned set of bins: the `edges` (increasing), the `labels` of the n = len(edges) - 1 bins and
+    which side is closed, like the arguments of `pd.cut`. With `right=False` the bins are [a, b), with `right=True`
+    they are (a, b] and `include_lowest=True` also puts the first edge in the first bin.
+    A scheme is never changed once used: a new binning is registered as a new version (see `register_scheme`).
+    """
+
+    def __init__(self, name, version, edges, labels, right=True, include_lowest=False):
+        if len(labels) != len(edges) - 1:
+            raise ValueError(f'{name} v{version}: {len(edges)} edges need {len(edges) - 1} labels, got {len(labels)}')
+        if any(low >= high for low, high in zip(edges[:-1], edges[1:])):
+            raise ValueError(f'{name} v{version}: edges must be increasing, got {edges}')
+        self.name = name
+        self.version = version
+        self.edges = list(edges)
+        self.labels = list(labels)
+        self.right = right
+        self.include_lowest = include_lowest
+
+    def __repr__(self):
+        return f'BinScheme({self.name!r}, v{self.version}, edges={self.edges}, right={self.right})'
+
+
+# registered bin schemes, by name and version
+BIN_SCHEMES = {}
+
+def register_scheme(scheme):
+    """
+    This function registers the bin scheme `scheme` and returns it. A version cannot be registered twice.
+    """
+    key = (scheme.name, scheme.version)
+    if key in BIN_SCHEMES:
+        raise ValueError(f'Bin scheme {scheme.name!r} v{scheme.version} is already registered')
+    BIN_SCHEMES[key] = scheme
+    return scheme
+
+def bin_scheme(name, version=None):
+    """
+    This function returns the registered bin scheme `name` at `version` (the latest one by default).
+    """
+    versions = [v for n, v in BIN_SCHEMES if n == name]
+    if not versions:
+        raise ValueError(f'Unknown bin scheme: {name!r}, expected one of {sorted({n for n, _ in BIN_SCHEMES})}')
+    version = max(versions) if version is None else version
+    if (name, version) not in BIN_SCHEMES:
+        raise ValueError(f'Unknown version of the bin scheme {name!r}: {version}, expected one of {sorted(versions)}')
+    return BIN_SCHEMES[(name, version)]
+
+# the ranges of the marketing campaign, closed on the left
+register_scheme(BinScheme('marketing_age', 1, [16, 24, 34, 44, 54, 64, 74],
+                          ['16-24', '25-34', '35-44', '45-54', '55-64', '65-74'], right=False))
+register_scheme(BinScheme('marketing_income', 1, [20000, 40000, 60000, 80000, 100000],
+                          ['20k-40k', '40k-60k', '60k-80k', '80k-100k'], right=False))
+
+# the ranges of the ads clicking data, closed on the right with the lowest edge included
+register_scheme(BinScheme('click_age', 1, [16, 24, 34, 44, 54, 90],
+                          ['16-24', '25-34', '35-44', '45-54', '55+'], right=True, include_lowest=True))
+register_scheme(BinScheme('click_income', 1, [20000, 40000, 60000, 80000, 100000],
+                          ['20k-40k', '40k-60k', '60k-80k', '80k-100k'], right=True, include_lowest=True))
+
+def bin_codes(values, scheme):
+    """
+    This function returns the bin of each of `values` (a pandas Series or a numpy array) in the bin scheme `scheme`
+    as an int8 array of codes, -1 for values outside the bins and missing values, with one `searchsorted` pass.
+    Integer arrays are searched as they are, other values as float64.
+    """
+    if isinstance(values, pd.Series):
+        values = values.to_numpy(dtype=None if values.dtype.kind in 'iu' else 'float64', na_value=np.nan)
+    values = np.asarray(values)
+    if values.dtype.kind not in 'iu':
+        values = values.astype('float64', copy=False)
+    edges = np.asarray(scheme.edges, dtype=values.dtype if values.dtype.kind == 'f' else 'int64')
+
+    # move the first edge just below itself, so (a, b] also holds a
+    if scheme.right and scheme.include_lowest:
+        edges[0] = np.nextafter(edges[0], -np.inf) if edges.dtype.kind == 'f' else edges[0] - 1
+
+    # the position of a value among the edges (before it, or up to it for bins closed on the left)
+    positions = np.searchsorted(edges, values, side='left' if scheme.right else 'right')
+
+    # turn the positions into codes with one lookup: below the first edge, above the last one or missing
+    # (sorted after all the edges) have no bin
+    lookup = np.arange(-1, len(edges), dtype='int8')
+    lookup[-1] = -1
+
+    return lookup[positions]
+
+def bin_series(series, scheme):
+    """
+    This function bins the pandas Series `series` with the bin scheme `scheme` and returns an ordered categorical
+    Series with the labels of the scheme, the same as `pd.cut(series, scheme.edges, labels=scheme.labels, ...)`
+    with the sides of the scheme.
+    """
+    categorical = pd.Categorical.from_codes(bin_codes(series, scheme), categories=scheme.labels, ordered=True)
+    return pd.Series(categorical, index=series.index, name=series.name)
@@ -0,0 +1,208 @@
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import pandas as pd
+
+# default location and size bound of the on-disk cache
+CACHE_DIR = '.cache'
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+def file_fingerprint(url, method='stat'):
+    """
+    This function returns a fingerprint of the file at `url`.
+    With `method='stat'` it uses the modification time and the size of the file (cheap),
+    with `method='hash'` it uses the SHA-256 of the file content (exact, reads the whole file).
+    """
+
+    if method == 'stat':
+        # the modification time and the size change whenever the file is rewritten
+        stat = os.stat(url)
+        return f'{stat.st_mtime_ns}-{stat.st_size}'
+
+    if method == 'hash':
+        # hash the content in blocks so big workbooks are not loaded in memory
+        digest = hashlib.sha256()
+        with open(url, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    raise ValueError(f"Unknown fingerprint method: {method!r}, expected 'stat' or 'hash'")
+
+def module_dependencies(module):
+    """
+    This function returns the modules of the project (the files in the directory of `module`) that `module` uses,
+    directly or through other modules of the project, including `module` itself, sorted by name.
+    A module is used when its functions, classes or the module itself are names of the global namespace, so the
+    modules only imported inside functions are not found.
+    """
+    root = os.path.dirname(os.path.abspath(module.__file__))
+    found = {}
+    pending = [module]
+
+    while pending:
+        current = pending.pop()
+        if current.__name__ in found:
+            continue
+        found[current.__name__] = current
+
+        # follow the imported modules and the modules of the imported functions and classes
+        for value in vars(current).values():
+            if inspect.ismodule(value):
+                used = value
+            elif inspect.isfunction(value) or inspect.isclass(value):
+                used = inspect.getmodule(value)
+            else:
+                continue
+            path = getattr(used, '__file__', None)
+            if path is not None and os.path.dirname(os.path.abspath(path)) == root:
+                pending.append(used)
+
+    return [found[name] for name in sorted(found)]
+
+def code_version(func):
+    """
+    This function returns a hash of the source of the module that defines `func` and of the modules of the project
+    it uses (see `module_dependencies`), so any change in the cleaning code, e.g. in the date parsing or the bins,
+    invalidates the entries built with it.
+    """
+    digest = hashlib.sha256()
+
+    # hash the whole modules, the cleaning function may rely on any of their functions
+    for module in module_dependencies(inspect.getmodule(func)):
+        digest.update(module.__name__.encode('utf-8'))
+        digest.update(inspect.getsource(module).encode('utf-8'))
+
+    return digest.hexdigest()
+
+def write_frames(frames, path):
+    """
+    This function writes a list of pandas DataFrames (`frames`) in the directory `path`.
+    Frames are stored as Parquet, except those with object columns (mixed types, e.g. the raw INE sheet)
+    that Parquet cannot round-trip exactly, which are pickled.
+    """
+    parts = []
+
+    for i, frame in enumerate(frames):
+        # choose the columnar format when the frame can be stored without changing its dtypes
+        if (frame.dtypes == object).any():
+            name = f'part_{i}.pkl'
+            frame.to_pickle(os.path.join(path, name))
+        else:
+            name = f'part_{i}.parquet'
+            frame.to_parquet(os.path.join(path, name))
+        parts.append(name)
+
+    return parts
+
+def read_frames(path, parts):
+    """
+    This function reads back the frames written by `write_frames` in the directory `path`.
+    """
+    frames = []
+
+    for name in parts:
+        # read each part with the reader of its format
+        if name.endswith('.parquet'):
+            frames.append(pd.read_parquet(os.path.join(path, name)))
+        else:
+            frames.append(pd.read_pickle(os.path.join(path, name)))
+
+    return frames
+
+def cache_size(path):
+    """
+    This function returns the total size in bytes of the files in the directory `path`.
+    """
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def evict_cache(cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, keep=None):
+    """
+    This function removes the least recently used entries of `cache_dir` until its size is under `max_bytes`.
+    The entry `keep` (the one just written) is never removed.
+    Returns the list of the removed entries.
+    """
+
+    if not os.path.isdir(cache_dir):
+        return []
+
+    # list the entries with their size and last use (the meta file is touched on every hit)
+    entries = []
+    for key in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, key)
+        meta = os.path.join(path, 'meta.json')
+        if os.path.isfile(meta):
+            entries.append((os.path.getmtime(meta), key, cache_size(path)))
+
+    # remove the oldest entries first
+    total = sum(size for _, _, size in entries)
+    removed = []
+    for _, key, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if key == keep:
+            continue
+        shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+        total -= size
+        removed.append(key)
+
+    return removed
+
+def read_excel_cached(url, clean=None, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, fingerprint='stat', **kwargs):
+    """
+    This function reads the Excel file `url` with `pd.read_excel` (extra `kwargs` are passed to it) and optionally
+    cleans it with `clean` (e.g. `clean_df_marketing` or `clean_df_product`), serving the result from an on-disk
+    cache when the same file was already loaded with the same cleaning code.
+    The cache key is built from the fingerprint of the file (see `file_fingerprint`), the version of the cleaning
+    code (see `code_version`) and the read options, so any change in one of them invalidates the entry.
+    The cache directory is kept under `max_bytes` by evicting the least recently used entries.
+    Returns what `clean` returns (a DataFrame or a tuple of DataFrames), or the raw DataFrame if `clean` is None.
+    """
+
+    # build the key of the entry
+    key_parts = {
+        'file': os.path.abspath(url),
+        'fingerprint': file_fingerprint(url, fingerprint),
+        'clean': None if clean is None else f'{clean.__module__}.{clean.__name__}:{code_version(clean)}',
+        'kwargs': repr(sorted(kwargs.items())),
+        'pandas': pd.__version__,
+    }
+    key = hashlib.sha256(json.dumps(key_parts, sort_keys=True).encode('utf-8')).hexdigest()
+    path = os.path.join(cache_dir, key)
+    meta_path = os.path.join(path, 'meta.json')
+
+    # serve the entry from the cache if it exists
+    if os.path.isfile(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        # mark the entry as recently used
+        os.utime(meta_path)
+        frames = read_frames(path, meta['parts'])
+        return tuple(frames) if meta['tuple'] else frames[0]
+
+    # parse and clean the file
+    result = pd.read_excel(url, **kwargs)
+    if clean is not None:
+        result = clean(result)
+
+    # store the result in a temporary directory and move it in place, so readers never see a partial entry
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    os.makedirs(tmp_path, exist_ok=True)
+    is_tuple = isinstance(result, tuple)
+    parts = write_frames(list(result) if is_tuple else [result], tmp_path)
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump({'parts': parts, 'tuple': is_tuple, 'key': key_parts}, f, indent=2)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # another process stored the same entry in the meantime
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+    # keep the cache directory under its size bound
+    evict_cache(cache_dir, max_bytes, keep=key)
+
+    return result
@@ -1,42 +1,266 @@
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import numpy as np
+from functions_bins import bin_scheme, bin_series
+from functions_trace import span, traced
 
+# columns kept by clean_df_click, the only ones the streaming reader parses
+CLICK_COLUMNS = ['Age', 'Gender', 'Income', 'Interest_Category', 'Click']
 
+# types of the columns as parsed from the CSV, for the frames of files without rows
+CLICK_DTYPES = {'Age': 'int64', 'Gender': str, 'Income': 'int64', 'Interest_Category': str, 'Click': 'int64'}
+
+# bin schemes (closed on the right, lowest edge included) of the income and age ranges, pinned like the marketing ones
+INCOME_SCHEME = bin_scheme('click_income', 1)
+AGE_SCHEME = bin_scheme('click_age', 1)
+INCOME_BINS, INCOME_LABELS = INCOME_SCHEME.edges, INCOME_SCHEME.labels
+AGE_BINS, AGE_LABELS = AGE_SCHEME.edges, AGE_SCHEME.labels
+
+# interest categories of the ads, they index the third axis of the click cube
+INTEREST_CATEGORIES = ['Fashion', 'Sports', 'Technology', 'Travel']
+
+# shape of the click cube: income range (+ out of range) x age range (+ out of range) x interest category x click
+CUBE_SHAPE = (len(INCOME_LABELS) + 1, len(AGE_LABELS) + 1, len(INTEREST_CATEGORIES), 2)
+
+
+@traced('clean')
 def clean_df_click(df):
     """
     This function takes a pandas DataFrame (`df`) and cleans/preprocesses it.
     It removes the columns: 'Unnamed: 0', 'Location', 'Device', 'Time_Spent_on_Site', 'Number_of_Pages_Viewed',
     and creates two new columns: 'Income_Range' and 'Age_Range', that are categorical bins of the 'Income' and 'Age' columns, respectively.
+    Columns that are already missing (e.g. skipped at parse time by `read_click_chunks`) are ignored.
     """
 
     # drop columns that are not useful for the analysis
-    df = df.drop(columns=['Unnamed: 0', 'Location', 'Device', 'Time_Spent_on_Site', 'Number_of_Pages_Viewed'])
-    
-    # create categorical bins for the Income column
-    bins = [20000, 40000, 60000, 80000, 100000]
-    labels = ['20k-40k', '40k-60k', '60k-80k', '80k-100k']
-    df['Income_Range'] = pd.cut(df['Income'], bins=bins, labels=labels, include_lowest=True)
+    df = df.drop(columns=['Unnamed: 0', 'Location', 'Device', 'Time_Spent_on_Site', 'Number_of_Pages_Viewed'], errors='ignore')
     
-    # create categorical bins for the Age column
-    bins = [16, 24, 34, 44, 54, 90]
-    labels = ['16-24', '25-34', '35-44', '45-54', '55+']
-    df['Age_Range'] = pd.cut(df['Age'], bins=bins, labels=labels, include_lowest=True)
+    with span('cut_ranges', 'clean', len(df)):
+        # create categorical bins for the Income column
+        df['Income_Range'] = bin_series(df['Income'], INCOME_SCHEME)
+
+        # create categorical bins for the Age column
+        df['Age_Range'] = bin_series(df['Age'], AGE_SCHEME)
     
     return df
 
-def click_by_category(df):
+def empty_click_frame(columns=CLICK_COLUMNS):
     """
-    This function takes a pandas DataFrame (`df`) and creates a bar plot showing the percentage of clicks
-    in each interest category.
+    This function returns the cleaned DataFrame of a CSV without rows, with the raw `columns` (all the ones kept by
+    the cleaning by default) and the ranges, typed like the cleaned rows of a real file.
     """
+    return clean_df_click(pd.DataFrame({column: pd.Series(dtype=CLICK_DTYPES[column]) for column in columns}))
+
+def read_click_chunks(url, chunksize=100000):
+    """
+    This function reads the ads clicking CSV (`url`) in chunks of `chunksize` rows and yields each chunk
+    cleaned with `clean_df_click`. Only the columns kept by the cleaning are parsed, so the peak memory
+    is bounded by the chunk size instead of the file size.
+    """
+
+    # parse only the useful columns, one bounded chunk at a time
+    reader = pd.read_csv(url, usecols=CLICK_COLUMNS, chunksize=chunksize)
+    while True:
+        with span('read_csv', 'load') as step:
+            chunk = next(reader, None)
+            step.rows_out = None if chunk is None else len(chunk)
+        if chunk is None:
+            break
+        yield clean_df_click(chunk)
+
+@traced('aggregate')
+def count_clicks(chunks):
+    """
+    This function takes an iterable of cleaned chunks (e.g. from `read_click_chunks`) and folds them into a pandas
+    Series with the number of rows for each income range, age range, interest category and click status.
+    Rows whose income or age falls outside the bins are kept under a NaN range.
+    """
+    counts = None
+
+    for chunk in chunks:
+        # count the rows of the chunk for each combination of the keys
+        chunk_counts = chunk.groupby(['Income_Range', 'Age_Range', 'Interest_Category', 'Click'], observed=False, dropna=False).size()
+
+        # add the counts to the running totals
+        counts = chunk_counts if counts is None else counts.add(chunk_counts, fill_value=0).astype('int64')
+
+    return counts
+
+@traced('aggregate')
+def click_cube(df):
+    """
+    This function takes a cleaned pandas DataFrame (`df`) and counts its rows in one pass into a dense integer
+    array of shape `CUBE_SHAPE`, indexed by income range, age range, interest category and click status.
+    The last income and age slots hold the rows outside the bins. Cubes of different files or days
+    are merged by adding them (`cube_a + cube_b`). A `functions_sql.SqlFrame` counts its rows with a SQL query.
+    """
+    if not isinstance(df, pd.DataFrame):
+        return df.click_cube()
+
+    # get the code of each row on every axis, rows outside the bins (-1) go to the last slot
+    income = df['Income_Range'].cat.codes.to_numpy() % CUBE_SHAPE[0]
+    age = df['Age_Range'].cat.codes.to_numpy() % CUBE_SHAPE[1]
+    category = pd.Categorical(df['Interest_Category'], categories=INTEREST_CATEGORIES).codes
+    click = df['Click'].to_numpy()
+
+    # the cube has a fixed layout, so unknown categories cannot be counted
+    if (category < 0).any():
+        unknown = sorted(set(df['Interest_Category'][category < 0].astype(str)))
+        raise ValueError(f'Unknown interest categories: {unknown}')
+
+    # count the rows of each cell
+    cells = np.ravel_multi_index((income, age, category, click), CUBE_SHAPE)
+    return np.bincount(cells, minlength=np.prod(CUBE_SHAPE)).reshape(CUBE_SHAPE)
+
+@traced('aggregate')
+def click_cube_chunks(chunks):
+    """
+    This function takes an iterable of cleaned chunks (e.g. from `read_click_chunks`) and returns the merged click cube.
+    """
+    cube = np.zeros(CUBE_SHAPE, dtype='int64')
+
+    # add the cube of each chunk
+    for chunk in chunks:
+        cube += click_cube(chunk)
+
+    return cube
+
+def csv_shards(url, shard_bytes=64 * 1024 * 1024):
+    """
+    This function splits the CSV file `url` into byte ranges of about `shard_bytes` bytes, aligned on line starts
+    and skipping the header line. Returns a list of (start, end) offsets.
+    """
+    size = os.path.getsize(url)
+
+    with open(url, 'rb') as f:
+        # the first shard starts after the header
+        f.readline()
+        bounds = [f.tell()]
+
+        # move each boundary to the start of the next line
+        while bounds[-1] + shard_bytes < size:
+            f.seek(bounds[-1] + shard_bytes - 1)
+            f.readline()
+            bounds.append(f.tell())
+
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if start < end]
+
+def read_click_shard(shard):
+    """
+    This function takes a shard (`url`, `start`, `end`) of the ads clicking CSV and returns it cleaned with `clean_df_click`.
+    Only the columns kept by the cleaning are parsed.
+    """
+    url, start, end = shard
+
+    # get the column names from the header, the shard has none
+    columns = pd.read_csv(url, nrows=0).columns
+
+    # read the bytes of the shard and parse them
+    with open(url, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    df = pd.read_csv(io.BytesIO(data), header=None, names=columns, usecols=CLICK_COLUMNS)
+
+    return clean_df_click(df)
+
+def click_shard_cube(shard):
+    """
+    This function takes a shard (`url`, `start`, `end`) of the ads clicking CSV and returns its click cube.
+    """
+    return click_cube(read_click_shard(shard))
+
+def map_click_shards(func, urls, workers=None, shard_bytes=64 * 1024 * 1024):
+    """
+    This function splits the CSV files `urls` (a path or a list of paths) into byte-range shards (see `csv_shards`),
+    applies `func` to every shard in a pool of `workers` processes (all the cores by default) and returns the results
+    in the order of the shards, so the output does not depend on the scheduling of the workers.
+    """
+    urls = [urls] if isinstance(urls, (str, os.PathLike)) else list(urls)
+
+    # list the shards of every file, in file order
+    shards = [(url, start, end) for url in urls for start, end in csv_shards(url, shard_bytes)]
+
+    # run the shards in the pool, map keeps the order of the shards
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(func, shards))
+
+def clean_df_click_parallel(urls, workers=None, shard_bytes=64 * 1024 * 1024):
+    """
+    This function reads and cleans the ads clicking CSV files `urls` in a pool of `workers` processes
+    and returns the same DataFrame as `clean_df_click` over the files read one after another.
+    """
+    frames = map_click_shards(read_click_shard, urls, workers, shard_bytes)
+
+    # join the shards in order, files with only a header have no shards
+    if not frames:
+        return empty_click_frame()
+    return pd.concat(frames, ignore_index=True)
+
+def click_cube_parallel(urls, workers=None, shard_bytes=64 * 1024 * 1024):
+    """
+    This function builds the click cube of the ads clicking CSV files `urls` in a pool of `workers` processes.
+    Each worker cleans and counts its shards and the partial cubes are added, which gives the same cube
+    as `click_cube` over the whole data.
+    """
+    cubes = map_click_shards(click_shard_cube, urls, workers, shard_bytes)
+
+    # add the partial cubes
+    return np.sum(cubes, axis=0) if cubes else np.zeros(CUBE_SHAPE, dtype='int64')
+
+def cube_rollup(cube, by):
+    """
+    This function rolls the click cube (`cube`) up to `by` ('Income_Range' or 'Age_Range') and interest category.
+    Returns the counts, an array indexed by range, interest category and click status, and the labels of the ranges.
+    Rows outside the bins are left out.
+    """
+    axis, labels = {'Income_Range': (0, INCOME_LABELS), 'Age_Range': (1, AGE_LABELS)}[by]
+
+    # sum the other range axis and drop the out of range slot
+    return cube.sum(axis=1 - axis)[:len(labels)], labels
+
+@traced('aggregate')
+def cube_click_percentage(cube, by):
+    """
+    This function rolls the click cube (`cube`) up to `by` ('Income_Range' or 'Age_Range') and interest category,
+    and returns a pandas DataFrame with the percentage of clicks of each cell (NaN for empty cells).
+    Rows outside the bins are left out.
+    """
+    counts, labels = cube_rollup(cube, by)
+
+    # calculate the percentage of clicks of each cell
+    total = counts.sum(axis=-1)
+    percentage = np.divide(counts[..., 1], total, out=np.full(total.shape, np.nan), where=total > 0) * 100
+
+    return pd.DataFrame(percentage, index=pd.Index(labels, name=by), columns=pd.Index(INTEREST_CATEGORIES, name='Interest_Category'))
+
+@traced('aggregate')
+def click_by_category_data(df):
+    """
+    This function returns the percentage of rows with and without a click in each interest category (categories
+    without rows left out) of a pandas DataFrame (`df`) or a click cube, the data of `click_by_category`.
+    """
+    # build the click cube unless it is given
+    cube = df if isinstance(df, np.ndarray) else click_cube(df)
+
+    # get the total counts for each category and click status, leaving out the categories without rows
+    counts = cube.sum(axis=(0, 1))
+    df_pivot = pd.DataFrame(counts, index=pd.Index(INTEREST_CATEGORIES, name='Interest_Category'), columns=pd.Index([0, 1], name='Click'))
+    df_pivot = df_pivot[counts.sum(axis=1) > 0]
 
-    # pivot the DataFrame to get the total counts for each category and click status
-    df_pivot = df.pivot_table(index='Interest_Category', columns='Click', aggfunc='size', fill_value=0)
-    
     # calculate the percentage of clicks for each category
-    df_pivot_percentage = df_pivot.div(df_pivot.sum(axis=1), axis=0) * 100
+    return df_pivot.div(df_pivot.sum(axis=1), axis=0) * 100
+
+@traced('render')
+def click_by_category(df):
+    """
+    This function takes a pandas DataFrame (`df`) or a click cube (see `click_cube`) and creates a bar plot
+    showing the percentage of clicks in each interest category.
+    """
+    import matplotlib.pyplot as plt
+    df_pivot_percentage = click_by_category_data(df)
     
     # plot the bar chart
     ax = df_pivot_percentage.plot(kind='bar', figsize=(8, 6), color=['#d9e6f2', '#4a90e2'])
@@ -62,23 +286,26 @@ def click_by_category(df):
     # show the plot
     plt.show()
 
-def click_by_category_income(df):
+@traced('aggregate')
+def click_by_category_income_data(df):
     """
-    This function takes a pandas DataFrame (`df`) and creates a bar plot showing the percentage of clicks
-    in each interest category for each income range.
+    This function returns the percentage of clicks of each income range and interest category of a pandas DataFrame
+    (`df`) or a click cube, the data of `click_by_category_income`.
     """
+    # build the click cube unless it is given
+    cube = df if isinstance(df, np.ndarray) else click_cube(df)
 
-    # group the DataFrame by income range, interest category, and click status
-    df_grouped = df.groupby(['Income_Range', 'Interest_Category', 'Click'], observed=False).size().unstack(fill_value=0)
-    
-    # calculate the total counts for each income range and interest category
-    df_grouped['Total'] = df_grouped[0] + df_grouped[1]
-    
     # calculate the percentage of clicks for each income range and interest category
-    df_grouped['Percentage_Click'] = df_grouped[1] / df_grouped['Total'] * 100
-    
-    # pivot the DataFrame to create a new DataFrame with the percentage of clicks
-    df_pivot = df_grouped.reset_index().pivot(index='Income_Range', columns='Interest_Category', values='Percentage_Click')
+    return cube_click_percentage(cube, 'Income_Range')
+
+@traced('render')
+def click_by_category_income(df):
+    """
+    This function takes a pandas DataFrame (`df`) or a click cube (see `click_cube`) and creates a bar plot
+    showing the percentage of clicks in each interest category for each income range.
+    """
+    import matplotlib.pyplot as plt
+    df_pivot = click_by_category_income_data(df)
 
     # create the figure and axis
     plt.figure(figsize=(10, 6))
@@ -107,24 +334,26 @@ def click_by_category_income(df):
     # show the plot
     plt.show()
 
-def click_by_category_age(df):
+@traced('aggregate')
+def click_by_category_age_data(df):
     """
-    This function takes a pandas DataFrame (`df`) and creates a bar plot showing the percentage of clicks
-    in each interest category for each age range.
+    This function returns the percentage of clicks of each age range and interest category of a pandas DataFrame
+    (`df`) or a click cube, the data of `click_by_category_age`.
     """
+    # build the click cube unless it is given
+    cube = df if isinstance(df, np.ndarray) else click_cube(df)
 
-    # group the DataFrame by age range and interest category, and calculate the total clicks and total counts
-    df_grouped = df.groupby(['Age_Range', 'Interest_Category'], observed=False).agg({'Click': ['sum', 'count']})
-
-    # rename the columns
-    df_grouped.columns = ['Total_Clicks', 'Total_Count']
-    
     # calculate the percentage of clicks for each age range and interest category
-    df_grouped['Percentage_Click'] = df_grouped['Total_Clicks'] / df_grouped['Total_Count'] * 100
+    return cube_click_percentage(cube, 'Age_Range')
 
-    # pivot the DataFrame to create a new DataFrame with the percentage of clicks
-    df_pivot = df_grouped.reset_index()
-    df_pivot =df_pivot.pivot(index='Age_Range', columns='Interest_Category', values='Percentage_Click')
+@traced('render')
+def click_by_category_age(df):
+    """
+    This function takes a pandas DataFrame (`df`) or a click cube (see `click_cube`) and creates a bar plot
+    showing the percentage of clicks in each interest category for each age range.
+    """
+    import matplotlib.pyplot as plt
+    df_pivot = click_by_category_age_data(df)
 
     # create the figure and axis
     plt.figure(figsize=(10, 6))
@@ -0,0 +1,125 @@
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from functions_click import AGE_LABELS, INCOME_LABELS, read_click_chunks
+
+# fixed-width type of the numeric columns of the store, the values must fit exactly
+STORE_NUMERIC = {'Age': 'int16', 'Income': 'int32', 'Click': 'int8'}
+
+# categorical columns stored as int8 codes: fixed categories for the bins, categories found while writing otherwise
+STORE_CATEGORIES = {'Gender': None, 'Interest_Category': None, 'Income_Range': INCOME_LABELS, 'Age_Range': AGE_LABELS}
+
+# version of the layout of the store, written in the schema
+STORE_VERSION = 1
+
+
+def category_codes(series, categories):
+    """
+    This function returns the codes of the values of `series` in the list `categories` as an int8 array (-1 for
+    missing values). Values not yet in `categories` are appended to it, so codes stay the same across chunks.
+    """
+    series = series.astype('category')
+
+    # translate the codes of the chunk into the codes of the store, once per category
+    for value in series.cat.categories:
+        if value not in categories:
+            categories.append(value)
+    if len(categories) > 127:
+        raise ValueError(f'Column {series.name!r} has more than 127 categories, too many for int8 codes')
+    lookup = np.array([categories.index(value) for value in series.cat.categories] + [-1], dtype='int8')
+
+    return lookup[series.cat.codes.to_numpy()]
+
+def fixed_width(series, dtype):
+    """
+    This function returns the values of the numeric `series` as an array of `dtype`, and refuses values that do
+    not fit in it exactly (missing, fractional or out of range values).
+    """
+    values = series.to_numpy()
+    converted = values.astype(dtype)
+    if not np.array_equal(converted, values):
+        raise ValueError(f'Column {series.name!r} has values that do not fit in {dtype}')
+    return converted
+
+def write_click_store(chunks, path):
+    """
+    This function writes the cleaned click chunks of `chunks` (e.g. from `read_click_chunks`) to the directory
+    `path` as one fixed-width binary file per column (`STORE_NUMERIC`, and int8 codes for `STORE_CATEGORIES`)
+    and a `schema.json` with the types, the categories and the number of rows. Chunks are appended one at a time,
+    so the memory is bounded by the chunk size. The store is written aside and moved in place.
+    Returns the schema.
+    """
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    categories = {column: list(labels or []) for column, labels in STORE_CATEGORIES.items()}
+    files = {column: open(os.path.join(tmp_path, f'{column}.bin'), 'wb') for column in [*STORE_NUMERIC, *STORE_CATEGORIES]}
+    rows = 0
+    try:
+        for chunk in chunks:
+            # append the raw bytes of each column
+            for column, dtype in STORE_NUMERIC.items():
+                files[column].write(fixed_width(chunk[column], dtype).tobytes())
+            for column in STORE_CATEGORIES:
+                files[column].write(category_codes(chunk[column], categories[column]).tobytes())
+            rows += len(chunk)
+    finally:
+        for f in files.values():
+            f.close()
+
+    schema = {
+        'version': STORE_VERSION,
+        'rows': rows,
+        'columns': ([{'name': column, 'dtype': dtype} for column, dtype in STORE_NUMERIC.items()]
+                    + [{'name': column, 'dtype': 'int8', 'categories': categories[column]} for column in STORE_CATEGORIES]),
+    }
+    with open(os.path.join(tmp_path, 'schema.json'), 'w') as f:
+        json.dump(schema, f, indent=2)
+
+    # replace an older store
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp_path, path)
+
+    return schema
+
+def convert_click_csv(url, path, chunksize=100000):
+    """
+    This function reads and cleans the ads clicking CSV `url` in chunks of `chunksize` rows and writes it to the
+    column store `path` (see `write_click_store`). Returns the schema.
+    """
+    return write_click_store(read_click_chunks(url, chunksize), path)
+
+def open_click_store(path, columns=None):
+    """
+    This function opens the column store `path` and returns its rows as a pandas DataFrame whose columns (all, or
+    only `columns`) are read-only memory maps of the column files: nothing is read until a column is used, and then
+    only the pages of that column. Categorical columns keep the categories of the schema. The frame has the
+    columns of `clean_df_click` with compact types, so `click_cube` and the click charts accept it.
+    """
+    with open(os.path.join(path, 'schema.json')) as f:
+        schema = json.load(f)
+    if schema['version'] != STORE_VERSION:
+        raise ValueError(f'Column store {path} has version {schema["version"]}, expected {STORE_VERSION}')
+
+    data = {}
+    for column in schema['columns']:
+        if columns is not None and column['name'] not in columns:
+            continue
+
+        # map the file, an empty file cannot be mapped
+        file_path = os.path.join(path, f'{column["name"]}.bin')
+        if schema['rows'] > 0:
+            values = np.memmap(file_path, dtype=column['dtype'], mode='r', shape=(schema['rows'],))
+        else:
+            values = np.empty(0, dtype=column['dtype'])
+
+        # wrap the codes without checking them, which would read the whole column
+        if 'categories' in column:
+            ordered = column['name'] in ('Income_Range', 'Age_Range')
+            values = pd.Categorical.from_codes(values, categories=column['categories'], ordered=ordered, validate=False)
+        data[column['name']] = values
+
+    return pd.DataFrame(data, copy=False)
@@ -0,0 +1,264 @@
+import argparse
+import functools
+import glob
+import hashlib
+import json
+import os
+import pickle
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import pandas as pd
+from functions_cache import code_version, file_fingerprint
+from functions_pipeline import filter_mask
+from functions_render import render_chart, use_agg
+
+# default location of the stage outputs
+DAG_CACHE_DIR = os.path.join('.cache', 'dag')
+
+
+class Stage:
+    """
+    A step of the report: `func` is called with the paths of the files `inputs`, then the outputs of the stages
+    `deps` (by name), then the keyword arguments `params`. A 'data' stage stores what `func` returns, a 'render'
+    stage draws a chart with `func` and stores the image (see `functions_render.render_chart`).
+    """
+
+    def __init__(self, name, func, deps=(), inputs=(), params=None, kind='data'):
+        if kind not in ('data', 'render'):
+            raise ValueError(f"Unknown kind: {kind!r}, expected 'data' or 'render'")
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.inputs = tuple(inputs)
+        self.params = dict(params or {})
+        self.kind = kind
+
+    def __repr__(self):
+        return f'Stage({self.name!r}, {self.func.__name__}, deps={list(self.deps)}, kind={self.kind!r})'
+
+
+def load_excel(url):
+    """
+    This function reads the first sheet of the workbook `url`.
+    """
+    return pd.read_excel(url)
+
+def load_csv(url, usecols=None):
+    """
+    This function reads the CSV file `url`, only the columns `usecols` (all by default).
+    """
+    return pd.read_csv(url, usecols=usecols)
+
+def select_item(result, index):
+    """
+    This function returns the item `index` of the output of a stage (e.g. one of the frames of `clean_df_product`).
+    """
+    return result[index]
+
+def filter_rows(df, filters):
+    """
+    This function returns the rows of `df` that pass all the `filters` (column, op, value), see `functions_pipeline`.
+    """
+    return df[filter_mask(df, filters)]
+
+def sort_stages(stages):
+    """
+    This function checks the dependencies of `stages` and returns them in an order where every stage comes after
+    its dependencies.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    if len(by_name) != len(stages):
+        raise ValueError('Stage names must be unique')
+
+    order, state = [], {}
+
+    def visit(name, path):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError(f'Cycle between the stages: {path + [name]}')
+        if name not in by_name:
+            raise ValueError(f'Unknown stage: {name!r} (needed by {path[-1]!r})')
+        state[name] = 'visiting'
+        for dep in by_name[name].deps:
+            visit(dep, path + [name])
+        state[name] = 'done'
+        order.append(by_name[name])
+
+    for stage in stages:
+        visit(stage.name, [])
+
+    return order
+
+def stage_key(stage, dep_keys, dpi=None):
+    """
+    This function returns the key of the output of `stage`: a hash of its code (see `code_version`), its parameters,
+    the fingerprints of its input files (see `file_fingerprint`) and the keys of its dependencies (`dep_keys`).
+    Changing an input file or a parameter therefore changes the key of the stage and of every stage downstream.
+    """
+    key_parts = {
+        'func': f'{stage.func.__module__}.{stage.func.__qualname__}:{code_version(stage.func)}',
+        'params': repr(sorted(stage.params.items())),
+        'inputs': [[os.path.abspath(url), file_fingerprint(url)] for url in stage.inputs],
+        'deps': list(dep_keys),
+        'dpi': dpi,
+        'pandas': pd.__version__,
+    }
+    return hashlib.sha256(json.dumps(key_parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+def run_stage(job):
+    """
+    This function runs one stage job (`kind`, `func`, `inputs`, `dep_paths`, `params`, `path`, `dpi`): it reads the
+    outputs of the dependencies from their files, calls the function and writes the output to `path`.
+    Returns `path`.
+    """
+    kind, func, inputs, dep_paths, params, path, dpi = job
+
+    # read the outputs of the dependencies
+    args = list(inputs)
+    for dep_path in dep_paths:
+        with open(dep_path, 'rb') as f:
+            args.append(pickle.load(f))
+
+    if kind == 'render':
+        return render_chart((functools.partial(func, **params), args, path, dpi))
+
+    # store the output in a temporary file and move it in place, so readers never see a partial output
+    result = func(*args, **params)
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+    return path
+
+def run_dag(stages, out_dir, cache_dir=DAG_CACHE_DIR, workers=None, fmt='png', dpi=100):
+    """
+    This function runs the `stages` of a report (a list of `Stage`) and renders its charts to `fmt` files in
+    `out_dir`, running the stages whose dependencies are done in a pool of `workers` processes (all the cores by
+    default, 1 runs them in the current process), so independent branches run at the same time.
+    The output of every data stage is stored in `cache_dir` under its key (see `stage_key`) and the images are named
+    after theirs, so a re-run only recomputes the stages downstream of a changed input, parameter or code. Data
+    stages are only run when a stage that must run needs them.
+    Returns a dict name -> path of the output and the list of the stages that ran.
+    """
+    order = sort_stages(stages)
+    os.makedirs(cache_dir, exist_ok=True)
+    os.makedirs(out_dir, exist_ok=True)
+
+    # get the key and the output path of every stage
+    keys, paths = {}, {}
+    for stage in order:
+        keys[stage.name] = stage_key(stage, [keys[dep] for dep in stage.deps], dpi if stage.kind == 'render' else None)
+        if stage.kind == 'render':
+            paths[stage.name] = os.path.join(out_dir, f'{stage.name}-{keys[stage.name][:16]}.{fmt}')
+        else:
+            paths[stage.name] = os.path.join(cache_dir, f'{stage.name}-{keys[stage.name]}.pkl')
+
+    # the charts without an image must run, and so must the missing dependencies of a stage that runs
+    by_name = {stage.name: stage for stage in order}
+    todo = set()
+    for stage in reversed(order):
+        if stage.name in todo or (stage.kind == 'render' and not os.path.exists(paths[stage.name])):
+            todo.add(stage.name)
+            todo.update(dep for dep in stage.deps if not os.path.exists(paths[dep]))
+
+    # remove the outputs of older keys of the stages that run
+    for name in todo:
+        folder, ext = (out_dir, fmt) if by_name[name].kind == 'render' else (cache_dir, 'pkl')
+        for old_path in glob.glob(os.path.join(glob.escape(folder), f'{glob.escape(name)}-*.{ext}')):
+            os.remove(old_path)
+
+    def job(stage):
+        return (stage.kind, stage.func, stage.inputs, [paths[dep] for dep in stage.deps], stage.params,
+                paths[stage.name], dpi)
+
+    ran = [stage.name for stage in order if stage.name in todo]
+
+    if workers == 1 or len(ran) <= 1:
+        # run the stages one after another, in the order of their dependencies
+        for name in ran:
+            run_stage(job(by_name[name]))
+        return paths, ran
+
+    # start every stage as soon as all its dependencies are done
+    done = set(by_name) - todo
+    waiting = [by_name[name] for name in ran]
+    with ProcessPoolExecutor(max_workers=workers, initializer=use_agg) as pool:
+        running = {}
+        while waiting or running:
+            for stage in [stage for stage in waiting if all(dep in done for dep in stage.deps)]:
+                waiting.remove(stage)
+                running[pool.submit(run_stage, job(stage))] = stage.name
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                # re-raise the errors of the stages
+                future.result()
+                done.add(running.pop(future))
+
+    return paths, ran
+
+def notebook_dag(datasets_dir='datasets'):
+    """
+    This function returns the stages of `main.ipynb`: load, clean, filter, aggregate and render, for the consumers
+    survey, the marketing campaign and the ads clicking datasets, which are three independent branches.
+    """
+    import functions_click as fc
+    import functions_dates as fd
+    import functions_marketing as fm
+    import functions_product as fp
+
+    stages = [
+        # consumers survey
+        Stage('consumers_raw', load_excel, inputs=[os.path.join(datasets_dir, 'consumers.xls')]),
+        Stage('consumers', fp.clean_df_product, deps=['consumers_raw']),
+        Stage('df_both', select_item, deps=['consumers'], params={'index': 0}),
+        Stage('df_men', select_item, deps=['consumers'], params={'index': 1}),
+        Stage('df_women', select_item, deps=['consumers'], params={'index': 2}),
+        Stage('consume_wine', fp.consume_wine, deps=['df_both'], kind='render'),
+        Stage('consume_m_w_by_age', fp.consume_m_w_by_age, deps=['df_men', 'df_women'], kind='render'),
+        Stage('consume_men_women', fp.consume_men_women, deps=['df_men', 'df_women'], kind='render'),
+        Stage('consume_by_age', fp.consume_by_age, deps=['df_both'], kind='render'),
+
+        # marketing campaign
+        Stage('marketing_raw', load_excel, inputs=[os.path.join(datasets_dir, 'marketing_campaign.xlsx')]),
+        Stage('marketing', fm.clean_df_marketing, deps=['marketing_raw']),
+        Stage('df_wine', filter_rows, deps=['marketing'], params={'filters': [('MntWines', '>', 200)]}),
+        Stage('df_income', filter_rows, deps=['marketing'],
+              params={'filters': [('Income', '<', 110000), ('Income', '>', 15000)]}),
+        Stage('rollups', fd.date_rollups, deps=['marketing'], params={'measures': ['MntWines']}),
+        Stage('site_purchases_by_age', fm.site_purchases_by_age, deps=['df_wine'], kind='render'),
+        Stage('site_purchases_by_income', fm.site_purchases_by_income, deps=['df_wine'], kind='render'),
+        Stage('web_visits_by_age', fm.web_visits_by_age, deps=['df_wine'], kind='render'),
+        Stage('income_by_ages', fm.income_by_ages, deps=['marketing'], kind='render'),
+        Stage('purchases_by_income', fm.purchases_by_income, deps=['df_income'], kind='render'),
+        Stage('purchases_by_income_line', fm.purchases_by_income_line, deps=['df_income'], kind='render'),
+        Stage('purchases_by_education', fm.purchases_by_education, deps=['marketing'], kind='render'),
+        Stage('son_at_home', fm.son_at_home, deps=['marketing'], kind='render'),
+        Stage('purchases_by_living_status', fm.purchases_by_living_status, deps=['marketing'], kind='render'),
+        Stage('purchases_by_month', fm.purchases_by_month, deps=['rollups'], kind='render'),
+
+        # ads clicking, the click charts only need the count cube
+        Stage('click_raw', load_csv, inputs=[os.path.join(datasets_dir, 'adsclicking.csv')],
+              params={'usecols': fc.CLICK_COLUMNS}),
+        Stage('click', fc.clean_df_click, deps=['click_raw']),
+        Stage('click_cube', fc.click_cube, deps=['click']),
+        Stage('click_by_category', fc.click_by_category, deps=['click_cube'], kind='render'),
+        Stage('click_by_category_income', fc.click_by_category_income, deps=['click_cube'], kind='render'),
+        Stage('click_by_category_age', fc.click_by_category_age, deps=['click_cube'], kind='render'),
+    ]
+
+    return stages
+
+if __name__ == '__main__':
+    # run the analysis of the notebook without a display
+    parser = argparse.ArgumentParser(description='Run the analysis of main.ipynb and render its charts to image files.')
+    parser.add_argument('out_dir', help='directory of the images')
+    parser.add_argument('--datasets', default='datasets', help='directory of the datasets')
+    parser.add_argument('--cache', default=DAG_CACHE_DIR, help='directory of the stage outputs')
+    parser.add_argument('--format', default='png', choices=['png', 'svg'], help='image format')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (all the cores by default)')
+    args = parser.parse_args()
+
+    paths, ran = run_dag(notebook_dag(args.datasets), args.out_dir, args.cache, args.workers, args.format)
+    for name, path in paths.items():
+        print(f"{name}: {path} ({'ran' if name in ran else 'cached'})")
@@ -0,0 +1,99 @@
+import pandas as pd
+from functions_trace import traced
+
+# date formats tried by detect_date_format, in order: month first before day first, like pandas, and ISO 8601
+# dates with or without a time last
+DATE_FORMATS = ['%Y-%m-%d', '%m-%d-%Y', '%d-%m-%Y', '%m/%d/%Y', '%d/%m/%Y', '%Y/%m/%d', '%Y-%m-%d %H:%M:%S',
+                '%m-%d-%Y %H:%M:%S', '%d-%m-%Y %H:%M:%S', 'ISO8601']
+
+# columns summed by date_rollups
+ROLLUP_MEASURES = ['MntWines', 'NumDealsPurchases', 'NumWebPurchases', 'NumCatalogPurchases', 'NumStorePurchases']
+
+# frequencies of the rollups: day, week (starting on Monday) and month
+ROLLUP_FREQUENCIES = ['D', 'W', 'M']
+
+
+def detect_date_format(values, dayfirst=False):
+    """
+    This function returns the first format of `DATE_FORMATS` that parses all the distinct non-missing strings of
+    `values`, or None when none of them does.
+    Ambiguous dates (01/02/2013) are read month first like pandas, or day first with `dayfirst=True`.
+    """
+    strings = pd.unique(pd.Series(values).dropna().astype(str))
+
+    # with dayfirst, the month first formats are tried last
+    formats = sorted(DATE_FORMATS, key=lambda date_format: dayfirst and date_format.startswith('%m'))
+    for date_format in formats:
+        try:
+            pd.to_datetime(strings, format=date_format)
+            return date_format
+        except (ValueError, TypeError):
+            continue
+
+    return None
+
+def parse_dates(series, date_format=None, dayfirst=False):
+    """
+    This function converts a pandas Series of date strings (`series`) to datetimes, like `pd.to_datetime(series)`,
+    but with one format for all the strings, detected over all of them (see `detect_date_format`) unless `date_format`
+    is given (e.g. detected once for all the chunks of a file), and parses each distinct string only once,
+    broadcasting the result to the rows. Raises a ValueError when the strings do not all have the same format, rather
+    than reading some of them day first and others month first. Series that are already datetimes are returned as
+    they are.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+
+    # parse the distinct strings and broadcast them with the codes, -1 (missing) becomes NaT
+    codes, uniques = pd.factorize(series)
+    if date_format is None:
+        date_format = detect_date_format(uniques, dayfirst=dayfirst)
+        if date_format is None:
+            raise ValueError(f'The dates of {series.name!r} do not all have one of the formats {DATE_FORMATS}')
+    try:
+        parsed = pd.DatetimeIndex(pd.to_datetime(uniques, format=date_format))
+    except (ValueError, TypeError) as error:
+        raise ValueError(f'The dates of {series.name!r} do not all have the format {date_format!r}') from error
+
+    return pd.Series(parsed.take(codes, allow_fill=True, fill_value=pd.NaT), index=series.index, name=series.name)
+
+@traced('aggregate')
+def date_rollups(df, date='Dt_Customer', measures=None):
+    """
+    This function takes a pandas DataFrame (`df`) and returns a dict with the daily ('D'), weekly ('W', weeks start
+    on Monday) and monthly ('M') totals of `measures` (`ROLLUP_MEASURES` by default) and the number of customers,
+    indexed by the first day of each period. The input frame is not modified.
+    A `functions_sql.SqlFrame` computes the daily totals with a SQL query.
+    """
+    if not isinstance(df, pd.DataFrame):
+        return df.date_rollups(date, measures)
+
+    measures = ROLLUP_MEASURES if measures is None else measures
+    dates = parse_dates(df[date])
+
+    # the daily totals are computed from the rows, the other periods from the daily totals
+    daily = df[measures].groupby(dates.dt.normalize().rename(date)).sum()
+    daily['Customers'] = dates.dt.normalize().value_counts().reindex(daily.index).to_numpy()
+
+    return rollups_from_daily(daily)
+
+def rollups_from_daily(daily):
+    """
+    This function rolls the daily totals (`daily`) up to weeks and months and returns the dict of the three rollups.
+    """
+    days = daily.index
+    weeks = (days - pd.to_timedelta(days.dayofweek, unit='D')).rename(days.name)
+    months = days.to_period('M').to_timestamp().rename(days.name)
+
+    return {'D': daily, 'W': daily.groupby(weeks).sum(), 'M': daily.groupby(months).sum()}
+
+def update_rollups(rollups, df, date='Dt_Customer'):
+    """
+    This function adds the rows of a new pandas DataFrame (`df`) to existing `rollups` (see `date_rollups`) and
+    returns the updated rollups. Only the new rows are scanned, the weeks and months are rebuilt from the daily totals.
+    """
+    new = date_rollups(df, date, [column for column in rollups['D'].columns if column != 'Customers'])
+
+    # add the new daily totals to the old ones
+    daily = rollups['D'].add(new['D'], fill_value=0).astype(rollups['D'].dtypes.to_dict())
+    return rollups_from_daily(daily)
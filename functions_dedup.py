@@ -0,0 +1,106 @@
+import sqlite3
+import numpy as np
+import pandas as pd
+
+# the in-memory DigestSet merges its newest run into the previous one while the previous one is at most this many
+# times larger, so the runs grow geometrically (like the levels of a log-structured merge tree)
+RUN_MERGE_RATIO = 2
+
+
+def row_digests(df, subset=None):
+    """
+    This function returns a 64-bit digest (uint64 array) of each row of the pandas DataFrame `df`, over the columns
+    `subset` (all by default). Numeric columns are hashed as float64 and the others as text, so the same row gets
+    the same digest whatever dtypes a chunk was inferred with (e.g. a chunk without missing incomes reads them as int).
+    With 64-bit digests, the chance of any collision among N distinct rows is about N² / 2⁶⁵ (3e-4 for 100M rows).
+    """
+    df = df if subset is None else df[subset]
+
+    # normalize the dtypes before hashing
+    normalized = pd.DataFrame({
+        column: df[column].astype('float64') if pd.api.types.is_numeric_dtype(df[column]) else df[column].astype(str)
+        for column in df.columns
+    })
+
+    return pd.util.hash_pandas_object(normalized, index=False).to_numpy()
+
+class DigestSet:
+    """
+    A set of row digests that tells which digests of a batch were never seen before.
+    In memory (`path=None`) the digests are kept as sorted uint64 runs of geometrically growing sizes, so there are
+    O(log n) runs and each digest is merged O(log n) times; the memory grows by 8 bytes per distinct row, without
+    bound. With a `path` they are kept in an on-disk SQLite table, so memory stays bounded by the batch size.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.runs = []
+        if path is not None:
+            self.connection = sqlite3.connect(path)
+            self.connection.execute('CREATE TABLE IF NOT EXISTS seen (digest INTEGER PRIMARY KEY) WITHOUT ROWID')
+
+    def __len__(self):
+        if self.path is not None:
+            return self.connection.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+        return sum(len(run) for run in self.runs)
+
+    def add_new(self, digests):
+        """
+        This method adds the distinct `digests` (uint64 array without repeats) to the set and returns the boolean
+        mask of the ones that were not in it before.
+        """
+        if self.path is not None:
+            # SQLite integers are signed, store the same 64 bits as int64
+            signed = digests.view('int64')
+            self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS batch (digest INTEGER PRIMARY KEY) WITHOUT ROWID')
+            self.connection.execute('DELETE FROM batch')
+            self.connection.executemany('INSERT INTO batch VALUES (?)', zip(signed.tolist()))
+
+            # look up the whole batch with one join, then add it with one statement
+            known = np.array(self.connection.execute('SELECT digest FROM batch JOIN seen USING (digest)').fetchall(),
+                             dtype='int64').reshape(-1)
+            self.connection.execute('INSERT OR IGNORE INTO seen SELECT digest FROM batch')
+            self.connection.commit()
+            return ~np.isin(signed, known)
+
+        # look for the digests in every sorted run
+        new = np.ones(len(digests), dtype=bool)
+        for run in self.runs:
+            positions = np.searchsorted(run, digests).clip(max=len(run) - 1)
+            new &= run[positions] != digests
+
+        # add the new digests as a run, and merge it with the previous runs of a similar size (a stable sort of two
+        # sorted runs is a linear merge)
+        if new.any():
+            self.runs.append(np.sort(digests[new]))
+        while len(self.runs) > 1 and len(self.runs[-2]) <= RUN_MERGE_RATIO * len(self.runs[-1]):
+            last = self.runs.pop()
+            self.runs[-1] = np.sort(np.concatenate([self.runs[-1], last]), kind='stable')
+
+        return new
+
+    def close(self):
+        """
+        This method closes the on-disk table, if any.
+        """
+        if self.path is not None:
+            self.connection.close()
+
+def drop_duplicates_chunks(chunks, subset=None, seen=None):
+    """
+    This function takes an iterable of pandas DataFrames (`chunks`) and yields each chunk without the rows already
+    seen in it or in a previous chunk (keeping the first occurrence, like `drop_duplicates`), together with the
+    number of rows dropped from it. Rows are compared by their digest over `subset` (all the columns by default,
+    see `row_digests`) and the digests are tracked in `seen` (a new in-memory DigestSet by default).
+    """
+    seen = DigestSet() if seen is None else seen
+
+    for chunk in chunks:
+        digests = row_digests(chunk, subset)
+
+        # keep the first occurrence inside the chunk, then the rows never seen before
+        first = ~pd.Series(digests).duplicated().to_numpy()
+        keep = np.zeros(len(chunk), dtype=bool)
+        keep[first] = seen.add_new(digests[first])
+
+        yield chunk[keep], int(len(chunk) - keep.sum())
@@ -0,0 +1,139 @@
+import glob
+import hashlib
+import json
+import os
+import numpy as np
+from functions_click import CUBE_SHAPE, click_by_category, click_by_category_age, click_by_category_income, click_cube, read_click_shard
+from functions_render import render_charts
+
+# default directory of the persisted state
+STATE_DIR = '.click_state'
+
+# bytes at the start of a file hashed to detect that it was rewritten
+HEAD_BYTES = 64 * 1024
+
+
+def head_hash(url, length):
+    """
+    This function returns the SHA-256 of the first `length` bytes (at most `HEAD_BYTES`) of the file `url`.
+    """
+    with open(url, 'rb') as f:
+        return hashlib.sha256(f.read(min(length, HEAD_BYTES))).hexdigest()
+
+def complete_end(url, start, size):
+    """
+    This function returns the offset just after the last newline of the file `url` between `start` and `size`,
+    so a line that is still being written is left for the next run. Returns `start` if there is no complete line.
+    """
+    with open(url, 'rb') as f:
+        end = size
+        # look for the last newline, block by block from the end
+        while end > start:
+            block_start = max(start, end - 64 * 1024)
+            f.seek(block_start)
+            block = f.read(end - block_start)
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                return block_start + newline + 1
+            end = block_start
+
+    return start
+
+def load_state(state_dir=STATE_DIR):
+    """
+    This function loads the watermarks and the click cube of each file from `state.npz` in `state_dir`.
+    Returns (watermarks, cubes), empty when there is no state yet.
+    """
+    state_path = os.path.join(state_dir, 'state.npz')
+    if not os.path.isfile(state_path):
+        return {}, {}
+
+    with np.load(state_path) as data:
+        meta = json.loads(str(data['meta']))
+        cubes = {url: data[f'cube_{i}'] for i, url in enumerate(meta['urls'])}
+
+    return meta['watermarks'], cubes
+
+def save_state(watermarks, cubes, state_dir=STATE_DIR):
+    """
+    This function writes the watermarks and the cubes to `state.npz` in `state_dir`. The watermarks and the cubes are
+    in one file, written aside and moved in place, so an interrupted run leaves the previous state whole and the
+    watermarks always match the counts.
+    """
+    os.makedirs(state_dir, exist_ok=True)
+
+    # the cube of each file is stored under its position in the list of files
+    urls = sorted(watermarks)
+    meta = {'urls': urls, 'watermarks': watermarks}
+
+    tmp_path = os.path.join(state_dir, 'state.tmp.npz')
+    np.savez(tmp_path, meta=json.dumps(meta), **{f'cube_{i}': cubes[url] for i, url in enumerate(urls)})
+    os.replace(tmp_path, os.path.join(state_dir, 'state.npz'))
+
+def read_new_rows(url, watermark):
+    """
+    This function reads the complete lines of the ads clicking CSV `url` after its `watermark` (a dict with the
+    'offset' and the 'rows' already processed, None for a new file) and returns them cleaned with `clean_df_click`
+    (None when there is nothing new), the new watermark and whether the file was read again from the start because
+    it is new, shrank or its start changed.
+    """
+    size = os.path.getsize(url)
+
+    # start over when the file is new or was rewritten
+    restarted = watermark is None or size < watermark['offset'] or head_hash(url, watermark['offset']) != watermark['head']
+    if restarted:
+        with open(url, 'rb') as f:
+            f.readline()
+            watermark = {'offset': f.tell(), 'rows': 0}
+
+    # read the complete lines after the watermark
+    df = None
+    end = complete_end(url, watermark['offset'], size)
+    if end > watermark['offset']:
+        df = read_click_shard((url, watermark['offset'], end))
+        watermark = {'offset': end, 'rows': watermark['rows'] + len(df)}
+
+    watermark['head'] = head_hash(url, watermark['offset'])
+    return df, watermark, restarted
+
+def update_click_state(urls, state_dir=STATE_DIR):
+    """
+    This function brings the persisted click state of `state_dir` up to date with the ads clicking CSV files `urls`
+    (a list of paths or a glob pattern) and returns the merged click cube.
+    For each file, the state keeps a watermark (bytes and rows already processed) and the click cube of those rows,
+    so only new files and the lines appended to known files are read, cleaned and counted. A file that shrank or whose
+    start changed was rewritten and is processed again from the start. Files that are no longer listed keep their
+    counts, the state is the whole history.
+    """
+    urls = sorted(glob.glob(urls)) if isinstance(urls, str) else list(urls)
+    watermarks, cubes = load_state(state_dir)
+
+    for url in urls:
+        key = os.path.abspath(url)
+        df, watermarks[key], restarted = read_new_rows(url, watermarks.get(key))
+
+        # count the new rows, from an empty cube when the file is read from the start
+        if restarted:
+            cubes[key] = np.zeros(CUBE_SHAPE, dtype='int64')
+        if df is not None:
+            cubes[key] = cubes[key] + click_cube(df)
+
+    save_state(watermarks, cubes, state_dir)
+
+    # merge the cubes of all the files
+    return sum(cubes.values(), np.zeros(CUBE_SHAPE, dtype='int64'))
+
+def refresh_click_charts(urls, out_dir, state_dir=STATE_DIR, fmt='png'):
+    """
+    This function updates the click state with the new data of `urls` (see `update_click_state`) and renders the
+    three click charts to `out_dir` from the merged cube. Charts are redrawn only when the cube changed.
+    Returns a dict name -> path of the image.
+    """
+    cube = update_click_state(urls, state_dir)
+
+    charts = {
+        'click_by_category': (click_by_category, cube),
+        'click_by_category_income': (click_by_category_income, cube),
+        'click_by_category_age': (click_by_category_age, cube),
+    }
+    return render_charts(charts, out_dir, fmt, workers=1)
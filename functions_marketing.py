@@ -1,9 +1,81 @@
+import itertools
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import numpy as np
+from functions_aggregate import group_aggregate
+from functions_bins import bin_scheme, bin_series
+from functions_dates import date_rollups, detect_date_format, parse_dates
+from functions_dedup import drop_duplicates_chunks
+from functions_regression import ols_band, ols_stats_chunks
+from functions_trace import span, traced
+
+# purchase counts by channel, averaged by site_purchases_by_age and site_purchases_by_income
+PURCHASE_COLUMNS = ['NumDealsPurchases', 'NumWebPurchases', 'NumCatalogPurchases', 'NumStorePurchases']
+
+# columns of counts and amounts that are downcast to small integers in compact mode
+COMPACT_INT_COLUMNS = ['MntWines', 'NumDealsPurchases', 'NumWebPurchases', 'NumCatalogPurchases', 'NumStorePurchases',
+                       'NumWebVisitsMonth', 'Age', 'Is_Parent']
+
+# broader categories of the education levels and the marital statuses
+EDUCATION_LEVELS = {'PhD': 'High', 'Master':'High', 
+                    '2n Cycle': 'Middle', 'Graduation': 'Middle', 
+                    'Basic': 'Low'
+}
+LIVING_STATUS = {'Alone': 'Living Alone', 'Absurd': 'Living Alone', 'YOLO': 'Living Alone', 'Widow': 'Living Alone', 'Single': 'Living Alone', 'Divorced': 'Living Alone',
+                 'Together': 'Living with Others', 'Married': 'Living with Others'
+}
+
+# bin schemes (closed on the left) of the age and income ranges, pinned so the ranges never change silently
+AGE_SCHEME = bin_scheme('marketing_age', 1)
+INCOME_SCHEME = bin_scheme('marketing_income', 1)
+AGE_BINS, AGE_LABELS = AGE_SCHEME.edges, AGE_SCHEME.labels
+INCOME_BINS, INCOME_LABELS = INCOME_SCHEME.edges, INCOME_SCHEME.labels
+
+# raw columns dropped by clean_df_marketing
+DROP_COLUMNS = ['Z_CostContact', 'Year_Birth', 'ID', 'Marital_Status', 'Education','Kidhome', 'Teenhome', 'Recency', 'MntFruits','MntMeatProducts',
+                'MntFishProducts', 'MntSweetProducts','MntGoldProds', 'AcceptedCmp3', 'AcceptedCmp4', 'AcceptedCmp5', 'AcceptedCmp1','AcceptedCmp2', 
+                'Complain', 'Z_CostContact', 'Z_Revenue', 'Response']
+
+def map_categories(series, mapping):
+    """
+    This function maps the values of a pandas Series (`series`) with the dict `mapping`, like `Series.replace`,
+    but on the categories of a categorical Series, so each distinct value is mapped once instead of once per row.
+    Values missing from `mapping` are kept. Returns a categorical Series with sorted categories.
+    """
+
+    # map the categories and get the new (sorted) categories
+    series = series.astype('category')
+    mapped = [mapping.get(value, value) for value in series.cat.categories]
+    categories = sorted(set(mapped))
+
+    # translate the old codes into the codes of the new categories, keeping -1 for missing values
+    lookup = np.array([categories.index(value) for value in mapped] + [-1], dtype='int8' if len(categories) < 127 else 'int32')
+    codes = lookup[series.cat.codes.to_numpy()]
+
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=series.index, name=series.name)
+
+def memory_report(df_before, df_after):
+    """
+    This function takes two pandas DataFrames (`df_before` and `df_after`, e.g. the output of `clean_df_marketing`
+    without and with `compact=True`) and returns a DataFrame with the memory in bytes of each column, the dtypes
+    and the bytes saved, plus a 'Total' row.
+    """
+
+    # get the deep memory usage of each column
+    report = pd.DataFrame({
+        'dtype_before': df_before.dtypes.astype(str),
+        'bytes_before': df_before.memory_usage(deep=True, index=False),
+        'dtype_after': df_after.dtypes.astype(str),
+        'bytes_after': df_after.memory_usage(deep=True, index=False),
+    })
+
+    # add the total and the bytes saved
+    report.loc['Total', ['bytes_before', 'bytes_after']] = report[['bytes_before', 'bytes_after']].sum()
+    report['bytes_saved'] = report['bytes_before'] - report['bytes_after']
+
+    return report
 
-def clean_df_marketing(df):
+@traced('clean')
+def clean_df_marketing(df, compact=False, drop_duplicates=True, date_format=None):
     """
     This function, `clean_df_marketing`, cleans and preprocesses a marketing dataset stored in a pandas 
     DataFrame (`df`). It performs the following operations:
@@ -14,29 +86,36 @@ def clean_df_marketing(df):
     5. **Parent status**
     6. **Age and income range binning**
     7. **Column removal**
+    With `compact=True` the mappings are done on category codes, text columns are categorical, counts are
+    downcast to the smallest integer type and `Income` is a nullable Int32 (values are the same, see `memory_report`).
+    With `drop_duplicates=False` duplicated rows are kept, for chunks already deduplicated (see `clean_df_marketing_chunks`).
+    `date_format` is the format of `Dt_Customer`, detected from the rows by default (see `parse_dates`).
     The function returns the cleaned and preprocessed DataFrame.
     """
 
     # strip whitespace from column names
     df.columns = df.columns.str.strip()
     # drop duplicate rows
-    df = df.drop_duplicates()
+    if drop_duplicates:
+        with span('drop_duplicates', 'clean', len(df)) as step:
+            df = df.drop_duplicates()
+            step.rows_out = len(df)
 
     # map specific education levels to broader categories
-    education_levels = {'PhD': 'High', 'Master':'High', 
-                        '2n Cycle': 'Middle', 'Graduation': 'Middle', 
-                        'Basic': 'Low'
-    }
-    df["Education_Level"] = df['Education'].replace(education_levels) 
+    if compact:
+        df["Education_Level"] = map_categories(df['Education'], EDUCATION_LEVELS)
+    else:
+        df["Education_Level"] = df['Education'].replace(EDUCATION_LEVELS) 
 
     # map specific living statuses to broader categories
-    living_status = {'Alone': 'Living Alone', 'Absurd': 'Living Alone', 'YOLO': 'Living Alone', 'Widow': 'Living Alone', 'Single': 'Living Alone', 'Divorced': 'Living Alone',
-                        'Together': 'Living with Others', 'Married': 'Living with Others'
-    } 
-    df['Living_Status'] = df['Marital_Status'].replace(living_status)
+    if compact:
+        df['Living_Status'] = map_categories(df['Marital_Status'], LIVING_STATUS)
+    else:
+        df['Living_Status'] = df['Marital_Status'].replace(LIVING_STATUS)
 
     # calculate age of customers based on birth year and customer date
-    df['Dt_Customer'] = pd.to_datetime(df['Dt_Customer'])
+    with span('parse_dates', 'clean', len(df)):
+        df['Dt_Customer'] = parse_dates(df['Dt_Customer'], date_format)
     df["Age"] = df['Dt_Customer'].dt.year - df["Year_Birth"]
 
     # create a new column indicating whether a customer has children at home
@@ -45,36 +124,84 @@ def clean_df_marketing(df):
     # drop customers with age > 100
     df = df[df['Age']<100]
 
-    # bin age values into categorical ranges
-    bins = [16, 24, 34, 44, 54, 64, 74] 
-    labels = ['16-24', '25-34', '35-44', '45-54', '55-64', '65-74']
-    df['Age_Range'] = pd.cut(df['Age'], bins=bins, labels=labels, right=False)
+    with span('cut_ranges', 'clean', len(df)):
+        # bin age values into categorical ranges
+        df['Age_Range'] = bin_series(df['Age'], AGE_SCHEME)
 
-    # bin income values into categorical ranges
-    bins = [20000, 40000, 60000, 80000, 100000]
-    labels = ['20k-40k', '40k-60k', '60k-80k', '80k-100k']
-    df['Income_Range'] = pd.cut(df['Income'], bins=bins, labels=labels, right=False)
+        # bin income values into categorical ranges
+        df['Income_Range'] = bin_series(df['Income'], INCOME_SCHEME)
 
     # drop unnecessary columns
-    to_drop = ['Z_CostContact', 'Year_Birth', 'ID', 'Marital_Status', 'Education','Kidhome', 'Teenhome', 'Recency', 'MntFruits','MntMeatProducts',
-            'MntFishProducts', 'MntSweetProducts','MntGoldProds', 'AcceptedCmp3', 'AcceptedCmp4', 'AcceptedCmp5', 'AcceptedCmp1','AcceptedCmp2', 
-            'Complain', 'Z_CostContact', 'Z_Revenue', 'Response']
-    df = df.drop(to_drop, axis=1)
+    df = df.drop(DROP_COLUMNS, axis=1)
+
+    # downcast the counts and store the income as a nullable small integer
+    if compact:
+        for column in COMPACT_INT_COLUMNS:
+            df[column] = pd.to_numeric(df[column], downcast='integer')
+        df['Income'] = df['Income'].astype('Int32')
 
     return df
 
+def read_excel_chunks(url, chunksize=100000):
+    """
+    This function reads the first sheet of the workbook `url` row by row (openpyxl read-only mode) and yields
+    pandas DataFrames of `chunksize` rows, so the whole sheet is never in memory.
+    """
+    import openpyxl
+    workbook = openpyxl.load_workbook(url, read_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows)
+
+        # group the rows in chunks, numbered like the rows of `pd.read_excel`
+        start = 0
+        while True:
+            chunk = list(itertools.islice(rows, chunksize))
+            if not chunk:
+                break
+            yield pd.DataFrame(chunk, columns=header, index=range(start, start + len(chunk)))
+            start += len(chunk)
+    finally:
+        workbook.close()
+
+def clean_df_marketing_chunks(url, chunksize=100000, subset=None, seen=None, compact=False, date_format=None):
+    """
+    This function reads the marketing workbook `url` in chunks of `chunksize` rows, drops the duplicated rows across
+    all the chunks with `drop_duplicates_chunks` (over the columns `subset`, all by default, tracking the digests in
+    `seen`, e.g. an on-disk `DigestSet('seen.db')`) and cleans each chunk with `clean_df_marketing`.
+    The format of the customer dates (`date_format`) is detected from the first chunk by default, so every chunk is
+    read the same way: a later chunk with dates of another format raises a ValueError, the format can then be given.
+    Yields each cleaned chunk with the number of duplicated rows dropped from it.
+    """
+
+    def stripped(chunks):
+        # strip whitespace from column names before comparing the rows
+        for chunk in chunks:
+            chunk.columns = chunk.columns.str.strip()
+            yield chunk
+
+    for chunk, dropped in drop_duplicates_chunks(stripped(read_excel_chunks(url, chunksize)), subset, seen):
+        if date_format is None and len(chunk) > 0:
+            date_format = detect_date_format(chunk['Dt_Customer'])
+        yield clean_df_marketing(chunk, compact=compact, drop_duplicates=False, date_format=date_format), dropped
+
+@traced('aggregate')
+def site_purchases_by_age_data(df_wine):
+    """
+    This function returns the average number of purchases of each type in each age range, the data of
+    `site_purchases_by_age`.
+    """
+    # group the DataFrame by age range and calculate the mean of each type of purchase
+    return group_aggregate(df_wine, 'Age_Range', PURCHASE_COLUMNS).reset_index()
+
+@traced('render')
 def site_purchases_by_age(df_wine):
     """
     This function takes a pandas DataFrame (`df_wine`) and creates a bar plot showing the average number of purchases 
     in each age range for each purchase type (Deals, Web, Catalog, Store).
     """
-    # group the DataFrame by age range and calculate the mean of each type of purchase
-    age_grouped = df_wine.groupby('Age_Range', observed=False).agg({
-        'NumDealsPurchases': 'mean',
-        'NumWebPurchases': 'mean',
-        'NumCatalogPurchases': 'mean',
-        'NumStorePurchases': 'mean',
-    }).reset_index()
+    import matplotlib.pyplot as plt
+    age_grouped = site_purchases_by_age_data(df_wine)
 
     # set the bar width
     bar_width = 0.15
@@ -115,17 +242,22 @@ def site_purchases_by_age(df_wine):
     # show the plot
     plt.show()
 
+@traced('aggregate')
+def site_purchases_by_income_data(df_wine):
+    """
+    This function returns the average number of purchases of each type in each income range, the data of
+    `site_purchases_by_income`.
+    """
+    return group_aggregate(df_wine, 'Income_Range', PURCHASE_COLUMNS).reset_index()
+
+@traced('render')
 def site_purchases_by_income(df_wine):
     """
     This function takes a pandas DataFrame (`df_wine`) and creates a bar plot showing the average number of purchases 
     in each income range for each purchase type (Deals, Web, Catalog, Store).
     """
-    income_grouped = df_wine.groupby('Income_Range', observed=False).agg({
-        'NumDealsPurchases': 'mean',
-        'NumWebPurchases': 'mean',
-        'NumCatalogPurchases': 'mean',
-        'NumStorePurchases': 'mean',
-    }).reset_index()
+    import matplotlib.pyplot as plt
+    income_grouped = site_purchases_by_income_data(df_wine)
 
     # set the bar width
     bar_width = 0.15
@@ -167,16 +299,27 @@ def site_purchases_by_income(df_wine):
     plt.show()
 
 
-def web_visits_by_age(df_wine):
+@traced('aggregate')
+def web_visits_by_age_data(df_wine):
     """
-    This function takes a pandas DataFrame (`df_wine`) and creates a bar plot showing the average number of visits 
-    in each age range in the website.
+    This function returns the average number of visits to the website in each age range, the data of
+    `web_visits_by_age`.
     """
     # group the DataFrame by age range and calculate the mean of average visits
-    avg_visits = df_wine.groupby('Age_Range', observed=False)['NumWebVisitsMonth'].mean().reset_index()
+    avg_visits = group_aggregate(df_wine, 'Age_Range', 'NumWebVisitsMonth').reset_index()
 
     # sort the DataFrame by age range
-    avg_visits = avg_visits.sort_values(by='Age_Range')
+    return avg_visits.sort_values(by='Age_Range')
+
+@traced('render')
+def web_visits_by_age(df_wine):
+    """
+    This function takes a pandas DataFrame (`df_wine`) and creates a bar plot showing the average number of visits 
+    in each age range in the website.
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    avg_visits = web_visits_by_age_data(df_wine)
 
     # create the figure and axis
     plt.figure(figsize=(10, 6))
@@ -196,12 +339,21 @@ def web_visits_by_age(df_wine):
     # show the plot
     plt.show()
 
+@traced('aggregate')
+def income_by_ages_data(df):
+    """
+    This function returns the average income in each age range, the data of `income_by_ages`.
+    """
+    return group_aggregate(df, 'Age_Range', 'Income')
+
+@traced('render')
 def income_by_ages(df):
     """
     This function takes a pandas DataFrame (`df`) and creates a bar plot showing the average income 
     in each age range.
     """
-    mean_income_by_age_range = df.groupby('Age_Range', observed=False)['Income'].mean()
+    import matplotlib.pyplot as plt
+    mean_income_by_age_range = income_by_ages_data(df)
 
     # create the figure and axis
     plt.figure(figsize=(10, 6))
@@ -224,16 +376,116 @@ def income_by_ages(df):
     # show the plot
     plt.show()
 
-def purchases_by_income(df_income):
+@traced('aggregate')
+def income_density(df_income, bins=60):
+    """
+    This function takes a pandas DataFrame (`df_income`) and counts the customers of each cell of a `bins` x `bins`
+    grid of income and wine purchases, with one vectorized pass. Rows with a missing value are left out.
+    Returns the counts (income along the first axis) and the edges of the income and wine bins.
+    A `functions_sql.SqlFrame` only reads the distinct (income, wine) pairs and their counts.
+    """
+    if not isinstance(df_income, pd.DataFrame):
+        # count each distinct pair once with the database, the counts weight the histogram
+        income, wines, weights = df_income.pair_counts('Income', 'MntWines')
+        return np.histogram2d(income, wines, bins=bins, weights=weights)
+
+    # drop the rows that cannot be placed in the grid
+    income = df_income['Income'].to_numpy(dtype='float64', na_value=np.nan)
+    wines = df_income['MntWines'].to_numpy(dtype='float64', na_value=np.nan)
+    valid = ~(np.isnan(income) | np.isnan(wines))
+
+    # count the customers of each cell
+    counts, income_edges, wine_edges = np.histogram2d(income[valid], wines[valid], bins=bins)
+
+    return counts, income_edges, wine_edges
+
+def stratified_sample(df_income, max_points=20000, strata=20, random_state=0):
+    """
+    This function takes a pandas DataFrame (`df_income`) and returns at most `max_points` rows, sampled in each of
+    `strata` equal-width income bands in proportion to its size (largest remainder method, with at least one row per
+    non-empty band when `max_points` allows it), so sparse incomes stay visible. Rows without income are left out.
+    The DataFrame is returned as it is if it has no more than `max_points` rows.
+    """
+    if len(df_income) <= max_points:
+        return df_income
+
+    # assign each row to an income band
+    income = df_income['Income'].to_numpy(dtype='float64', na_value=np.nan)
+    edges = np.linspace(np.nanmin(income), np.nanmax(income), strata + 1)
+    band = np.clip(np.searchsorted(edges, income, side='right') - 1, 0, strata - 1)
+    band[np.isnan(income)] = -1
+
+    # share the rows between the non-empty bands in proportion to their size
+    bands, sizes = np.unique(band[band >= 0], return_counts=True)
+    quota = sizes * min(max_points / sizes.sum(), 1.0)
+    counts = np.minimum(np.maximum(np.floor(quota), 1), sizes).astype('int64')
+    if len(bands) > max_points:
+        # not enough rows for every band, keep one row of the largest bands
+        counts[:] = 0
+        counts[np.argsort(-sizes, kind='stable')[:max_points]] = 1
+
+    # take back the rows given above the quota by the minimum, from the largest bands
+    while counts.sum() > max_points:
+        counts[np.argmax(np.where(counts > 1, counts, 0))] -= 1
+
+    # give the rows left to the bands with the largest remainders
+    left = max_points - counts.sum()
+    if left > 0:
+        room = np.flatnonzero(counts < sizes)
+        counts[room[np.argsort(-(quota - counts)[room], kind='stable')[:left]]] += 1
+
+    # draw the rows of each band
+    rng = np.random.default_rng(random_state)
+    keep = [rng.choice(np.flatnonzero(band == b), size=count, replace=False) for b, count in zip(bands, counts) if count > 0]
+
+    return df_income.iloc[np.sort(np.concatenate(keep))]
+
+def draw_income_points(df_income, kind, bins=60, max_points=20000):
+    """
+    This function draws the customers of `df_income` (income vs wine purchases) on the current axis:
+    one marker per customer (`kind='scatter'`), a stratified sample of at most `max_points` customers (`'sample'`),
+    a 2D histogram of `bins` x `bins` cells (`'hist2d'`) or hexagonal bins (`'hexbin'`).
+    The density kinds take the same time to draw whatever the number of customers.
+    """
+    import matplotlib.pyplot as plt
+
+    # the markers need the rows, read the two columns from a `functions_sql.SqlFrame`
+    if not isinstance(df_income, pd.DataFrame) and kind != 'hist2d':
+        df_income = df_income.to_pandas(['Income', 'MntWines'])
+
+    if kind == 'scatter':
+        plt.scatter(df_income['Income'], df_income['MntWines'], color='#6a9ac4', alpha=0.7, edgecolor='k')
+    elif kind == 'sample':
+        sample = stratified_sample(df_income, max_points)
+        plt.scatter(sample['Income'], sample['MntWines'], color='#6a9ac4', alpha=0.7, edgecolor='k')
+    elif kind == 'hist2d':
+        # hide the empty cells
+        counts, income_edges, wine_edges = income_density(df_income, bins)
+        plt.pcolormesh(income_edges, wine_edges, np.ma.masked_equal(counts.T, 0), cmap='Blues')
+        plt.colorbar(label='Customers')
+    elif kind == 'hexbin':
+        income = df_income['Income'].to_numpy(dtype='float64', na_value=np.nan)
+        wines = df_income['MntWines'].to_numpy(dtype='float64', na_value=np.nan)
+        valid = ~(np.isnan(income) | np.isnan(wines))
+        plt.hexbin(income[valid], wines[valid], gridsize=bins, cmap='Blues', mincnt=1)
+        plt.colorbar(label='Customers')
+    else:
+        raise ValueError(f"Unknown kind: {kind!r}, expected 'scatter', 'sample', 'hist2d' or 'hexbin'")
+
+@traced('render')
+def purchases_by_income(df_income, kind='scatter', bins=60, max_points=20000):
     """
     This function takes a pandas DataFrame (`df_income`) and creates a scatter plot showing the relationship between
-    income and wine purchases.
+    income and wine purchases. For millions of customers, use `kind='hist2d'`, `'hexbin'` or `'sample'`
+    (see `draw_income_points`).
     """
+    import matplotlib.pyplot as plt
+
     # create the figure and axis
     plt.figure(figsize=(10, 6))
 
-    # plot the scatter plot
-    plt.scatter(df_income['Income'], df_income['MntWines'], color='#6a9ac4', alpha=0.7, edgecolor='k')
+    # plot the customers
+    draw_income_points(df_income, kind, bins, max_points)
 
     # set the x-axis label
     plt.xlabel('Incomes')
@@ -247,16 +499,60 @@ def purchases_by_income(df_income):
     # show the plot
     plt.show()
 
-def purchases_by_income_line(df_income):
+def draw_regression_line(stats, level=0.95):
+    """
+    This function draws on the current axis the least squares line and its analytical confidence band at `level`
+    from the sufficient statistics `stats` (see `functions_regression.ols_stats`), over the range of the incomes.
+    """
+    import matplotlib.pyplot as plt
+
+    # evaluate the line and the band over the range of x
+    x = np.linspace(stats[6], stats[7], 100)
+    fitted, lower, upper = ols_band(stats, x, level)
+
+    # draw them like seaborn does
+    plt.plot(x, fitted, color='red', lw=2)
+    plt.fill_between(x, lower, upper, color='red', alpha=0.15, linewidth=0)
+
+@traced('render')
+def purchases_by_income_line(df_income, kind='scatter', bins=60, max_points=20000, fit='ols', stats=None):
     """
     This function takes a pandas DataFrame (`df_income`) and creates a scatter plot with a regression line showing the relationship between
-    income and wine purchases.
+    income and wine purchases. For millions of customers, use `kind='hist2d'`, `'hexbin'` or `'sample'`
+    (see `draw_income_points`), the line is still fitted on all the customers.
+    With `fit='ols'` the line and its 95% band are computed in closed form from sufficient statistics, which can be
+    given (`stats`, e.g. merged over chunks with `ols_stats_chunks`) instead of being computed from `df_income`.
+    `fit='bootstrap'` uses the bootstrapped band of `sns.regplot` (refits 1000 times).
+    With a `functions_sql.SqlFrame` and `kind='hist2d'`, the density and the sufficient statistics are computed by
+    the database (the band then matches the pandas one up to float rounding).
     """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    # the markers and seaborn need the rows of a `functions_sql.SqlFrame`, read them once
+    if not isinstance(df_income, pd.DataFrame) and (kind != 'hist2d' or fit == 'bootstrap'):
+        df_income = df_income.to_pandas(['Income', 'MntWines'])
+
     # create the figure and axis
     plt.figure(figsize=(10, 6))
 
-    # plot the scatter plot with a regression line
-    sns.regplot(x='Income', y='MntWines', data=df_income, scatter_kws={'color': '#6a9ac4', 'alpha': 0.7, 'edgecolor': 'k'}, line_kws={'color': 'red', 'lw': 2})
+    if fit == 'bootstrap' and kind == 'scatter':
+        # plot the scatter plot with a regression line
+        sns.regplot(x='Income', y='MntWines', data=df_income, scatter_kws={'color': '#6a9ac4', 'alpha': 0.7, 'edgecolor': 'k'}, line_kws={'color': 'red', 'lw': 2})
+    elif fit == 'bootstrap':
+        # plot the customers and the regression line
+        draw_income_points(df_income, kind, bins, max_points)
+        sns.regplot(x='Income', y='MntWines', data=df_income, scatter=False, line_kws={'color': 'red', 'lw': 2})
+    elif fit == 'ols':
+        # plot the customers and the line fitted from the sufficient statistics
+        draw_income_points(df_income, kind, bins, max_points)
+        if stats is None and isinstance(df_income, pd.DataFrame):
+            stats = ols_stats_chunks([df_income])
+        elif stats is None:
+            stats = df_income.ols_stats('Income', 'MntWines')
+        draw_regression_line(stats)
+    else:
+        raise ValueError(f"Unknown fit: {fit!r}, expected 'ols' or 'bootstrap'")
 
     # set the x-axis label
     plt.xlabel('Incomes')
@@ -270,17 +566,30 @@ def purchases_by_income_line(df_income):
     # show the plot
     plt.show()
 
-def purchases_by_education(df):
+@traced('aggregate')
+def purchases_by_education_data(df):
     """
-    This function takes a pandas DataFrame (`df`) and creates a bar plot showing the average number of purchases 
-    in each education level.
+    This function returns the average wine purchases of each education level, sorted by purchases, the data of
+    `purchases_by_education`.
     """
     # group the DataFrame by education level and calculate the mean of purchases
+    education_mean = group_aggregate(df, 'Education_Level', 'MntWines', observed=True).reset_index()
 
-    education_mean = df.groupby('Education_Level')['MntWines'].mean().reset_index()
+    # plot the levels as text, so a categorical column (compact mode) keeps the order of the bars
+    education_mean['Education_Level'] = education_mean['Education_Level'].astype(str)
 
     # sort the DataFrame by mean of purchases
-    education_mean = education_mean.sort_values(by='MntWines')
+    return education_mean.sort_values(by='MntWines')
+
+@traced('render')
+def purchases_by_education(df):
+    """
+    This function takes a pandas DataFrame (`df`) and creates a bar plot showing the average number of purchases 
+    in each education level.
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    education_mean = purchases_by_education_data(df)
 
     # create the figure and axis
     plt.figure(figsize=(10, 6))
@@ -303,17 +612,27 @@ def purchases_by_education(df):
     # show the plot
     plt.show()
 
-def son_at_home(df):
+@traced('aggregate')
+def son_at_home_data(df):
     """
-    This function takes a pandas DataFrame (`df`) and creates a pie plot showing the average number of purchases 
-    in each parent status.
+    This function returns the average wine purchases of each parent status, with readable labels, the data of
+    `son_at_home`.
     """
     # group the DataFrame by parent status and calculate the mean of purchases
-
-    parent_mean = df.groupby('Is_Parent')['MntWines'].mean().reset_index()
+    parent_mean = group_aggregate(df, 'Is_Parent', 'MntWines', observed=True).reset_index()
 
     # map 0 and 1 to human readable labels
     parent_mean['Is_Parent'] = parent_mean['Is_Parent'].map({0: 'Not son at home', 1: 'Son at home'})
+    return parent_mean
+
+@traced('render')
+def son_at_home(df):
+    """
+    This function takes a pandas DataFrame (`df`) and creates a pie plot showing the average number of purchases 
+    in each parent status.
+    """
+    import matplotlib.pyplot as plt
+    parent_mean = son_at_home_data(df)
 
     # create the figure and axis
     plt.figure(figsize=(7, 7))
@@ -327,14 +646,27 @@ def son_at_home(df):
     # show the plot
     plt.show()
 
+@traced('aggregate')
+def purchases_by_living_status_data(df):
+    """
+    This function returns the average wine purchases of each living status, the data of `purchases_by_living_status`.
+    """
+    # group the DataFrame by living status and calculate the mean of purchases
+    spend_by_livingstatus = group_aggregate(df, 'Living_Status', 'MntWines', observed=True).reset_index()
+
+    # plot the statuses as text, so a categorical column (compact mode) keeps the order of the bars
+    spend_by_livingstatus['Living_Status'] = spend_by_livingstatus['Living_Status'].astype(str)
+    return spend_by_livingstatus
+
+@traced('render')
 def purchases_by_living_status(df):
     """
     This function takes a pandas DataFrame (`df`) and creates a bar plot showing the average number of purchases 
     in each living status.
     """
-    # group the DataFrame by living status and calculate the mean of purchases
-
-    spend_by_livingstatus = df.groupby('Living_Status')['MntWines'].mean().reset_index()
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    spend_by_livingstatus = purchases_by_living_status_data(df)
 
     # create the figure and axis
     plt.figure(figsize=(10, 6))
@@ -349,8 +681,8 @@ def purchases_by_living_status(df):
     plt.ylabel('Average purchases wine')
 
     # add the text on the bars
-    for i, row in spend_by_livingstatus.iterrows():
-        ax.text(i, row['MntWines'] + 0.5, f'{row["MntWines"]:.2f}', ha='center')
+    for i, value in enumerate(spend_by_livingstatus['MntWines'].to_numpy()):
+        ax.text(i, value + 0.5, f'{value:.2f}', ha='center')
 
     # adjust the layout
     plt.tight_layout()
@@ -358,18 +690,28 @@ def purchases_by_living_status(df):
     # show the plot
     plt.show()
 
-def purchases_by_month(df):
+@traced('aggregate')
+def purchases_by_month_data(df):
     """
-    This function takes a pandas DataFrame (`df`) and creates a bar plot showing the total purchases wine
-    in each month of the year.
+    This function returns the total wine purchases of each month of the year (1 to 12) from a pandas DataFrame
+    (`df`) or its date rollups, the data of `purchases_by_month`. The DataFrame is not modified.
     """
+    # Get the monthly totals, from the rollups when they are given
+    rollups = df if isinstance(df, dict) else date_rollups(df, measures=['MntWines'])
+    monthly = rollups['M']
 
-    # Add a new column 'Month' to the DataFrame
-    # This column will contain the month of each customer's date
-    df['Month'] = df['Dt_Customer'].dt.month
+    # Sum the totals of each month of the year
+    return monthly.groupby(monthly.index.month.rename('Month'))['MntWines'].sum().reset_index()
 
-    # Group the DataFrame by 'Month' and calculate the sum of 'MntWines'
-    monthly_sales = df.groupby('Month')['MntWines'].sum().reset_index()
+@traced('render')
+def purchases_by_month(df):
+    """
+    This function takes a pandas DataFrame (`df`), or its date rollups (see `functions_dates.date_rollups`),
+    and creates a bar plot showing the total purchases wine in each month of the year.
+    The DataFrame is not modified.
+    """
+    import matplotlib.pyplot as plt
+    monthly_sales = purchases_by_month_data(df)
 
     # Create the figure and axis
     plt.figure(figsize=(10, 6))
@@ -0,0 +1,178 @@
+import operator
+import pandas as pd
+from functions_click import CLICK_COLUMNS, clean_df_click, empty_click_frame
+from functions_marketing import clean_df_marketing
+
+# comparison operators accepted by LazyFrame.filter
+OPERATORS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge, '==': operator.eq, '!=': operator.ne}
+
+# raw columns that keep their values through the cleaning, predicates on them are pushed before the cleaning
+PASSTHROUGH_COLUMNS = {
+    'marketing': ['Income', 'MntWines', 'NumDealsPurchases', 'NumWebPurchases', 'NumCatalogPurchases',
+                  'NumStorePurchases', 'NumWebVisitsMonth'],
+    'click': CLICK_COLUMNS,
+}
+
+# columns read by each chart
+CHART_COLUMNS = {
+    'site_purchases_by_age': ['Age_Range', 'NumDealsPurchases', 'NumWebPurchases', 'NumCatalogPurchases', 'NumStorePurchases'],
+    'site_purchases_by_income': ['Income_Range', 'NumDealsPurchases', 'NumWebPurchases', 'NumCatalogPurchases', 'NumStorePurchases'],
+    'web_visits_by_age': ['Age_Range', 'NumWebVisitsMonth'],
+    'income_by_ages': ['Age_Range', 'Income'],
+    'purchases_by_income': ['Income', 'MntWines'],
+    'purchases_by_income_line': ['Income', 'MntWines'],
+    'purchases_by_education': ['Education_Level', 'MntWines'],
+    'son_at_home': ['Is_Parent', 'MntWines'],
+    'purchases_by_living_status': ['Living_Status', 'MntWines'],
+    'purchases_by_month': ['Dt_Customer', 'MntWines'],
+    'click_by_category': ['Income_Range', 'Age_Range', 'Interest_Category', 'Click'],
+    'click_by_category_income': ['Income_Range', 'Age_Range', 'Interest_Category', 'Click'],
+    'click_by_category_age': ['Income_Range', 'Age_Range', 'Interest_Category', 'Click'],
+}
+
+
+class LazyFrame:
+    """
+    A lazy query over the marketing campaign or ads clicking dataset: `filter` and `select` only record the
+    operations, and nothing is read until `collect` (or `plot_charts`) runs the plan. When the plan runs,
+    predicates on raw columns are applied before the cleaning and only the requested columns are kept.
+    For the click CSV the projection is also pushed to the parser, which reads it in chunks.
+    The marketing sheet is always read whole, because `clean_df_marketing` drops duplicates over all the columns.
+    """
+
+    def __init__(self, source, url, filters=(), columns=None):
+        if source not in PASSTHROUGH_COLUMNS:
+            raise ValueError(f"Unknown source: {source!r}, expected 'marketing' or 'click'")
+        self.source = source
+        self.url = url
+        self.filters = tuple(filters)
+        self.columns = None if columns is None else tuple(columns)
+
+    def __repr__(self):
+        return f'LazyFrame({self.source!r}, {self.url!r}, filters={list(self.filters)}, columns={self.columns})'
+
+    def filter(self, column, op, value):
+        """
+        This method returns a new plan that keeps the rows where `column <op> value` (e.g. `filter('MntWines', '>', 200)`).
+        """
+        if op not in OPERATORS:
+            raise ValueError(f'Unknown operator: {op!r}, expected one of {list(OPERATORS)}')
+        return LazyFrame(self.source, self.url, self.filters + ((column, op, value),), self.columns)
+
+    def select(self, *columns):
+        """
+        This method returns a new plan that keeps only `columns`.
+        """
+        return LazyFrame(self.source, self.url, self.filters, columns)
+
+    def collect(self):
+        """
+        This method runs the plan and returns the cleaned, filtered and projected DataFrame.
+        """
+        return collect_many([self])[0]
+
+
+def scan_marketing(url='datasets/marketing_campaign.xlsx'):
+    """
+    This function returns a lazy plan over the marketing campaign workbook, cleaned with `clean_df_marketing`.
+    """
+    return LazyFrame('marketing', url)
+
+def scan_click(url='datasets/adsclicking.csv'):
+    """
+    This function returns a lazy plan over the ads clicking CSV, cleaned with `clean_df_click`.
+    """
+    return LazyFrame('click', url)
+
+def filter_mask(df, filters):
+    """
+    This function returns the boolean mask of the rows of `df` that pass all the `filters` (column, op, value).
+    """
+    mask = pd.Series(True, index=df.index)
+
+    for column, op, value in filters:
+        mask &= OPERATORS[op](df[column], value).fillna(False).astype(bool)
+
+    return mask
+
+def read_source(source, url, columns, filters):
+    """
+    This function reads and cleans `url`, keeping only the rows that pass at least one of the sets of raw
+    `filters` (a list with one list of filters per plan, an empty list keeps every row) and, for the click CSV,
+    parsing only the raw `columns`.
+    """
+
+    def keep_rows(raw):
+        # keep the rows needed by at least one plan
+        if any(len(plan_filters) == 0 for plan_filters in filters):
+            return raw
+        mask = pd.Series(False, index=raw.index)
+        for plan_filters in filters:
+            mask |= filter_mask(raw, plan_filters)
+        return raw[mask]
+
+    if source == 'click':
+        # parse only the columns used, chunk by chunk, filtering each chunk before the cleaning
+        usecols = [column for column in CLICK_COLUMNS if column in columns or column in ('Age', 'Income')]
+        chunks = [clean_df_click(keep_rows(chunk)) for chunk in pd.read_csv(url, usecols=usecols, chunksize=100000)]
+        # a file with only a header gives no chunk or one untyped empty chunk, use the typed empty frame instead
+        chunks = [chunk for chunk in chunks if len(chunk) > 0]
+        return pd.concat(chunks) if chunks else empty_click_frame(usecols)
+
+    # the whole sheet is needed for the duplicates, but filtered rows are not cleaned
+    raw = pd.read_excel(url)
+    raw.columns = raw.columns.str.strip()
+    return clean_df_marketing(keep_rows(raw))
+
+def collect_many(plans):
+    """
+    This function runs several lazy plans (`plans`) and returns their DataFrames.
+    Plans over the same file are fused: the file is read and cleaned once, with the union of their columns
+    and of their rows, and each plan then applies its own filters and projection.
+    """
+    frames = [None] * len(plans)
+
+    # group the plans by file
+    groups = {}
+    for i, plan in enumerate(plans):
+        groups.setdefault((plan.source, plan.url), []).append(i)
+
+    for (source, url), indices in groups.items():
+        passthrough = PASSTHROUGH_COLUMNS[source]
+
+        # the columns needed by the plans of the file (None means all of them)
+        columns = set()
+        for i in indices:
+            if plans[i].columns is None:
+                columns = None
+                break
+            columns.update(plans[i].columns)
+            columns.update(column for column, _, _ in plans[i].filters)
+
+        # the predicates that can run on the raw rows
+        raw_filters = [[f for f in plans[i].filters if f[0] in passthrough] for i in indices]
+
+        # read and clean the file once
+        df = read_source(source, url, set(CLICK_COLUMNS) if columns is None else columns, raw_filters)
+
+        # apply the filters and the projection of each plan
+        for i in indices:
+            plan = plans[i]
+            frame = df[filter_mask(df, plan.filters)] if plan.filters else df
+            frames[i] = frame[list(plan.columns)] if plan.columns is not None else frame
+
+    return frames
+
+def plot_charts(jobs):
+    """
+    This function takes a list of (`plan`, `chart`) pairs, e.g. `[(scan_marketing().filter('MntWines', '>', 200),
+    site_purchases_by_age)]`, restricts each plan to the columns its chart reads (see `CHART_COLUMNS`), runs all the
+    plans together with `collect_many` and draws each chart with its DataFrame.
+    """
+
+    # project each plan on the columns of its chart
+    plans = [plan.select(*CHART_COLUMNS[chart.__name__]) if plan.columns is None else plan for plan, chart in jobs]
+
+    # run the plans and draw the charts
+    for (_, chart), frame in zip(jobs, collect_many(plans)):
+        chart(frame)
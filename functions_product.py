@@ -1,8 +1,64 @@
+import re
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import numpy as np
+from functions_trace import span, traced
 
+# headers of the sex blocks of the INE sheet, in the order of the output, with their name in the long format
+SEX_BLOCKS = {'Ambos sexos': 'both', 'Varones': 'men', 'Hombres': 'men', 'Mujeres': 'women'}
+
+# names of the first seven columns of the INE sheet
+PRODUCT_COLUMNS = ['years', 'total', '4+', '1-3', '-1', '<<1', '0']
+
+def age_label(text):
+    """
+    This function turns an age label of the INE sheet (e.g. '        De 16 a 24 años', 'De 75 y más años', 'Total')
+    into the short label used in the analysis ('16-24', '75+', 'Total').
+    """
+    text = str(text).strip()
+
+    # ranges with two bounds, ranges with only the lower bound and the total row
+    match = re.fullmatch(r'De (\d+) a (\d+) años', text)
+    if match:
+        return f'{match.group(1)}-{match.group(2)}'
+    match = re.fullmatch(r'De (\d+) y más años', text)
+    if match:
+        return f'{match.group(1)}+'
+    return text
+
+def find_sex_blocks(labels, section='CIFRAS RELATIVAS'):
+    """
+    This function takes the first column of the INE sheet (`labels`, a pandas Series) and finds, after the `section`
+    header, the rows of the Ambos sexos / Varones (or Hombres) / Mujeres blocks by their header labels.
+    Each block goes from the row after its header to the last row before a blank or another header.
+    Returns a dict header -> index labels of the rows of the block.
+    """
+    stripped = labels.astype('string').str.strip()
+
+    # start after the section header
+    positions = np.flatnonzero((stripped == section).fillna(False).to_numpy())
+    if len(positions) == 0:
+        raise ValueError(f'Section {section!r} not found in the sheet')
+
+    blocks = {}
+    header = None
+    for position in range(positions[0] + 1, len(stripped)):
+        label = stripped.iloc[position]
+        if pd.isna(label) or label == '':
+            # a blank row closes the block
+            header = None
+        elif label in SEX_BLOCKS:
+            header = label
+            blocks[header] = []
+        elif header is not None:
+            blocks[header].append(labels.index[position])
+
+    if not {'Ambos sexos', 'Mujeres'} <= set(blocks) or not {'Varones', 'Hombres'} & set(blocks):
+        raise ValueError(f'Sex blocks not found after {section!r}, found: {list(blocks)}')
+
+    return {header: pd.Index(rows) for header, rows in blocks.items()}
+
+@traced('clean')
 def clean_df_product(df):
     """
     Clean the dataframe to get the data of both, men and women
@@ -13,8 +69,11 @@ def clean_df_product(df):
     df = df.iloc[:,:7].copy()
 
     # Rename the columns
-    name_columns =  ['years','total','4+', '1-3', '-1','<<1','0']
-    df.columns = name_columns
+    df.columns = PRODUCT_COLUMNS
+
+    # Find the rows of each block by their header
+    blocks = find_sex_blocks(df['years'])
+    men_header = 'Varones' if 'Varones' in blocks else 'Hombres'
     
     # Replace the values of the years column
     df['years'] = df['years'].replace({
@@ -29,35 +88,94 @@ def clean_df_product(df):
     })
 
     # Get the data of both, men and women
-    df_both = df.loc[37:44].copy()
+    df_both = df.loc[blocks['Ambos sexos']].copy()
     df_both.index = range(1, len(df_both)+1)
     df_both['total_cons'] = df_both['4+']+df_both['1-3']+df_both['-1']+df_both['<<1']
     df_both = df_both.drop(columns=['total','4+', '1-3', '-1','<<1'])
 
     # Get the data of men
-    df_men = df.loc[46:53].copy()
+    df_men = df.loc[blocks[men_header]].copy()
     df_men.index = range(1, len(df_men)+1)
     df_men['total_cons'] = df_men['4+']+df_men['1-3']+df_men['-1']+df_men['<<1']
     df_men = df_men.drop(columns=['total', '4+', '1-3', '-1','<<1'])
 
     # Get the data of women
-    df_women = df.loc[55:62].copy()
+    df_women = df.loc[blocks['Mujeres']].copy()
     df_women.index = range(1, len(df_women)+1)
     df_women['total_cons'] = df_women['4+']+df_women['1-3']+df_women['-1']+df_women['<<1']
     df_women = df_women.drop(columns=['total', '4+', '1-3', '-1','<<1'])
 
     return df_both, df_men, df_women
 
+@traced('load')
+def load_consumers(url, year=None, region=None):
+    """
+    This function reads the first seven columns of an INE consumer survey workbook (`url`), finds its sex blocks
+    by their header labels (see `find_sex_blocks`) and returns them as a long-format DataFrame with one row per
+    year, region, sex and age range, the percentage of each consumption frequency and `total_cons`.
+    """
+
+    # parse only the first seven columns
+    with span('read_excel', 'load') as step:
+        df = pd.read_excel(url, usecols=range(7))
+        step.rows_out = len(df)
+    df.columns = PRODUCT_COLUMNS
+
+    frames = []
+    for header, rows in find_sex_blocks(df['years']).items():
+        # take the rows of the block as numbers
+        block = df.loc[rows, PRODUCT_COLUMNS[1:]].apply(pd.to_numeric, errors='coerce')
+        block.insert(0, 'age', [age_label(text) for text in df.loc[rows, 'years']])
+        block.insert(0, 'sex', SEX_BLOCKS[header])
+        frames.append(block)
+
+    long = pd.concat(frames, ignore_index=True)
+    long['total_cons'] = long['4+'] + long['1-3'] + long['-1'] + long['<<1']
+    long.insert(0, 'region', region)
+    long.insert(0, 'year', year)
+
+    return long
+
+def load_consumers_task(source):
+    """
+    This function loads one (`url`, `year`, `region`) source with `load_consumers`, for the process pool.
+    """
+    return load_consumers(*source)
+
+def load_consumers_many(sources, workers=None):
+    """
+    This function loads many INE consumer survey workbooks (`sources`, a list of (`url`, `year`, `region`) tuples)
+    in a pool of `workers` processes (all the cores by default) and returns a single long-format DataFrame
+    (see `load_consumers`) in the order of `sources`, indexed by year, region, sex and age.
+    """
+    sources = list(sources)
+
+    # load the workbooks in parallel, map keeps the order of the sources
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        frames = list(pool.map(load_consumers_task, sources))
+
+    return pd.concat(frames, ignore_index=True).set_index(['year', 'region', 'sex', 'age'])
+
+@traced('aggregate')
+def consume_wine_data(df_both):
+    """
+    This function returns the percentage of consumers and not consumers between 16 and 75 years old as a pandas
+    Series, the data of `consume_wine`.
+    """
+    return pd.Series([df_both['total_cons'].iloc[0], df_both['0'].iloc[0]], index=['Consumers', 'Not consumers'])
+
+@traced('render')
 def consume_wine(df_both):
     """
     This function takes a pandas DataFrame (`df_both`) containing data about the consumption of wine 
     and creates a pie plot showing the percentage of consumers and not consumers between 16 and 75 years old.
     """
+    import matplotlib.pyplot as plt
 
     # Get the values to plot
-
-    labels = ['Consumers', 'Not consumers']
-    values = [df_both['total_cons'].iloc[0], df_both['0'].iloc[0]]
+    shares = consume_wine_data(df_both)
+    labels = list(shares.index)
+    values = list(shares)
 
     # Set the colors for the pie chart
     colors = ['#A3E4D7', '#FAD7A0']
@@ -77,15 +195,23 @@ def consume_wine(df_both):
     # Show the plot
     plt.show()
 
+@traced('aggregate')
+def consume_m_w_by_age_data(df_men, df_women):
+    """
+    This function returns the rows of each age range (without the total) of `df_men` and `df_women`, the data of
+    `consume_m_w_by_age`.
+    """
+    # Filter out the total values
+    return df_men[df_men['years'] != 'Total'], df_women[df_women['years'] != 'Total']
+
+@traced('render')
 def consume_m_w_by_age(df_men, df_women):
     """
     This function takes two pandas DataFrames (`df_men` and `df_women`) containing data about the consumption of wine
     by men and women, respectively, and creates a line plot showing the percentage of consumers in each age range.
     """
-
-    # Filter out the total values
-    df_men_filtered = df_men[df_men['years'] != 'Total']
-    df_women_filtered = df_women[df_women['years'] != 'Total']
+    import matplotlib.pyplot as plt
+    df_men_filtered, df_women_filtered = consume_m_w_by_age_data(df_men, df_women)
 
     # Create the figure and axis
     plt.figure(figsize=(10, 6))
@@ -115,22 +241,32 @@ def consume_m_w_by_age(df_men, df_women):
     # Show the plot
     plt.show()
 
+@traced('aggregate')
+def consume_men_women_data(df_men, df_women):
+    """
+    This function returns the total percentage of consumers of men and women as a pandas Series, the data of
+    `consume_men_women`.
+    """
+    # Get the total rows
+    total_men = df_men[df_men['years'] == 'Total']
+    total_women = df_women[df_women['years'] == 'Total']
+    return pd.Series([total_men['total_cons'].values[0], total_women['total_cons'].values[0]], index=['Men', 'Women'])
+
+@traced('render')
 def consume_men_women(df_men, df_women):
     """
     This function takes two pandas DataFrames (`df_men` and `df_women`) containing data about the consumption of wine
     by men and women, respectively, and creates a bar plot showing the total percentage of consumers.
     """
-
-    # Filter out the total values
-    total_men = df_men[df_men['years'] == 'Total']
-    total_women = df_women[df_women['years'] == 'Total']
+    import matplotlib.pyplot as plt
+    totals = consume_men_women_data(df_men, df_women)
 
     # Create the figure and axis
     plt.figure(figsize=(8, 6))
 
     # Plot the bars
-    plt.bar('Men', total_men['total_cons'].values[0], color='#a3c2c2') 
-    plt.bar('Women', total_women['total_cons'].values[0], color='#f2b5d4') 
+    plt.bar('Men', totals['Men'], color='#a3c2c2') 
+    plt.bar('Women', totals['Women'], color='#f2b5d4') 
 
     # Set the axis labels
     plt.ylabel('Consumers (%)')
@@ -139,21 +275,31 @@ def consume_men_women(df_men, df_women):
     plt.tight_layout()
 
     # Add the text labels
-    for index, value in enumerate([total_men['total_cons'].values[0], total_women['total_cons'].values[0]]):
+    for index, value in enumerate(totals):
         plt.text(index, value + 1, f'{value:.2f}%', ha='center', va='bottom', fontsize=12, color='black')
 
     # Show the plot
     plt.show()
 
+@traced('aggregate')
+def consume_by_age_data(df_both):
+    """
+    This function returns the rows of the age ranges of `df_both` (16-24 to 75+), the data of `consume_by_age`.
+    """
+    return df_both.loc[2:8]
+
+@traced('render')
 def consume_by_age(df_both):
     """
     This function takes a pandas DataFrame (`df_both`) containing data about the consumption of wine 
     by population >16 years old and creates a bar plot showing the percentage of consumers in each age range.
     """
-    
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     # Create the figure and axis
     plt.figure(figsize=(10, 6))
-    ax = sns.barplot(x='years', y='total_cons', data=df_both.loc[2:8], palette='viridis',hue='total_cons', legend=False)
+    ax = sns.barplot(x='years', y='total_cons', data=consume_by_age_data(df_both), palette='viridis',hue='total_cons', legend=False)
     
     # Set the title, labels and x-tick rotation
 
@@ -162,18 +308,10 @@ def consume_by_age(df_both):
     plt.ylabel('Total consumption (%)')
     plt.xticks(rotation=30) 
     
-    # Add the text labels on the bars
-    for p in ax.patches:
-        # Get the height of the bar
-        height = p.get_height()
-        # Round the height to 2 decimal places
-        rounded_height = round(height, 2)
-        # Annotate the bar with the rounded value
-        ax.annotate(f'{rounded_height}', 
-                    (p.get_x() + p.get_width() / 2., height), 
-                    ha='center', va='center', 
-                    xytext=(0, 5),
-                    textcoords='offset points')
+    # Add the text labels on the bars, one call per group of bars
+    for container in ax.containers:
+        # Annotate each bar with its height rounded to 2 decimal places
+        ax.bar_label(container, fmt=lambda height: f'{round(height, 2)}', padding=0, label_type='edge')
 
     # Adjust the layout
     plt.tight_layout()
@@ -0,0 +1,174 @@
+import glob
+import json
+import os
+import numpy as np
+import pandas as pd
+from functions_click import AGE_LABELS, AGE_SCHEME, INCOME_LABELS, INCOME_SCHEME, INTEREST_CATEGORIES
+from functions_incremental import STATE_DIR, read_new_rows
+
+# default directory of the persisted model
+MODEL_DIR = os.path.join(STATE_DIR, 'model')
+
+# one-hot fields with their categories, each also gets a last slot for unknown or out of range values
+ONE_HOT_FIELDS = {
+    'Gender': ['Female', 'Male'],
+    'Interest_Category': INTEREST_CATEGORIES,
+    'Income_Range': INCOME_LABELS,
+    'Age_Range': AGE_LABELS,
+}
+
+# numeric fields, scaled to the span of their bin scheme so the scale does not depend on the data seen
+NUMERIC_SCHEMES = {'Age': AGE_SCHEME, 'Income': INCOME_SCHEME}
+
+# names of the columns of the encoded matrix
+FEATURE_NAMES = (['bias']
+                 + [f'{field}={value}' for field, values in ONE_HOT_FIELDS.items() for value in values + ['other']]
+                 + list(NUMERIC_SCHEMES))
+
+
+def encode_clicks(df):
+    """
+    This function encodes the cleaned click rows of the pandas DataFrame `df` (see `clean_df_click`) as a float64
+    matrix with the columns `FEATURE_NAMES`: a bias, the one-hot codes of the gender, the interest category and the
+    income and age ranges, and the scaled age and income. Missing numbers are encoded as 0.
+    """
+    x = np.zeros((len(df), len(FEATURE_NAMES)))
+    rows = np.arange(len(df))
+    x[:, 0] = 1
+
+    # set the slot of the code of each row, unknown values (-1) go to the last slot of the field
+    offset = 1
+    for field, values in ONE_HOT_FIELDS.items():
+        codes = pd.Categorical(df[field], categories=values).codes.astype('int64')
+        x[rows, offset + np.where(codes < 0, len(values), codes)] = 1
+        offset += len(values) + 1
+
+    for field, scheme in NUMERIC_SCHEMES.items():
+        values = df[field].to_numpy(dtype='float64', na_value=np.nan)
+        scaled = (values - scheme.edges[0]) / (scheme.edges[-1] - scheme.edges[0])
+        x[:, offset] = np.where(np.isnan(scaled), 0, scaled)
+        offset += 1
+
+    return x
+
+def sigmoid(z):
+    """
+    This function returns the logistic function of every value of `z`, clipped so large values do not overflow.
+    """
+    return 1 / (1 + np.exp(-np.clip(z, -35, 35)))
+
+def new_click_model(learning_rate=0.05, l2=1e-6):
+    """
+    This function returns an untrained click propensity model: a logistic regression on the encoded rows (see
+    `encode_clicks`) trained with AdaGrad, at `learning_rate` with an L2 penalty `l2`.
+    The model is a dict with the weights, the sums of squared gradients, the rows seen and the watermarks of the
+    files it was trained on (see `update_click_model`).
+    """
+    return {
+        'features': list(FEATURE_NAMES),
+        'weights': np.zeros(len(FEATURE_NAMES)),
+        'grad_squares': np.zeros(len(FEATURE_NAMES)),
+        'learning_rate': learning_rate,
+        'l2': l2,
+        'rows': 0,
+        'watermarks': {},
+    }
+
+def partial_fit_clicks(model, df, batch_size=512):
+    """
+    This function trains the click model `model` on the cleaned click rows of `df` in one pass of mini-batches of
+    `batch_size` rows, in a random order, and returns it (it is updated in place). The cost only depends on the
+    rows of `df`, so a model is kept up to date by training it on each new chunk.
+    """
+    x = encode_clicks(df)
+    y = df['Click'].to_numpy(dtype='float64')
+    order = np.random.default_rng(model['rows']).permutation(len(x))
+    weights, grad_squares = model['weights'], model['grad_squares']
+
+    for batch_start in range(0, len(x), batch_size):
+        batch = order[batch_start:batch_start + batch_size]
+
+        # gradient of the mean log loss of the batch
+        error = sigmoid(x[batch] @ weights) - y[batch]
+        gradient = x[batch].T @ error / len(batch) + model['l2'] * weights
+
+        # step of each weight scaled by its past gradients, rare categories keep larger steps
+        grad_squares += gradient * gradient
+        weights -= model['learning_rate'] * gradient / (np.sqrt(grad_squares) + 1e-8)
+
+    model['rows'] += len(x)
+    return model
+
+def train_click_model(chunks, model=None, batch_size=512):
+    """
+    This function trains the click model `model` (a new one by default) on every cleaned chunk of `chunks`
+    (e.g. from `read_click_chunks`) and returns it.
+    """
+    model = new_click_model() if model is None else model
+    for chunk in chunks:
+        partial_fit_clicks(model, chunk, batch_size)
+    return model
+
+def score_clicks(model, df):
+    """
+    This function returns the click probability of every cleaned click row of `df` under `model`, with one
+    matrix-vector product for the whole batch.
+    """
+    return sigmoid(encode_clicks(df) @ model['weights'])
+
+def click_log_loss(model, df):
+    """
+    This function returns the mean log loss of `model` on the cleaned click rows of `df`.
+    """
+    p = np.clip(score_clicks(model, df), 1e-15, 1 - 1e-15)
+    y = df['Click'].to_numpy(dtype='float64')
+    return -np.mean(y * np.log(p) + (1 - y) * np.log(1 - p))
+
+def save_click_model(model, model_dir=MODEL_DIR):
+    """
+    This function writes `model` to `model_dir`, aside and then moved in place so an interrupted run leaves the
+    previous model readable.
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    meta = {key: value for key, value in model.items() if key not in ('weights', 'grad_squares')}
+
+    tmp_path = os.path.join(model_dir, 'model.tmp.npz')
+    np.savez(tmp_path, weights=model['weights'], grad_squares=model['grad_squares'], meta=json.dumps(meta))
+    os.replace(tmp_path, os.path.join(model_dir, 'model.npz'))
+
+def load_click_model(model_dir=MODEL_DIR):
+    """
+    This function reads the model written by `save_click_model` in `model_dir`, or returns a new model if there is
+    none. A model saved with other features is refused.
+    """
+    path = os.path.join(model_dir, 'model.npz')
+    if not os.path.isfile(path):
+        return new_click_model()
+
+    with np.load(path) as archive:
+        model = json.loads(str(archive['meta']))
+        model['weights'] = archive['weights']
+        model['grad_squares'] = archive['grad_squares']
+
+    if model['features'] != FEATURE_NAMES:
+        raise ValueError(f'The model in {model_dir} was trained on other features, train a new one')
+    return model
+
+def update_click_model(urls, model_dir=MODEL_DIR, batch_size=512):
+    """
+    This function trains the persisted click model of `model_dir` on the rows of the ads clicking CSV files `urls`
+    (a list of paths or a glob pattern) it has not seen yet, i.e. new files and lines appended to known files
+    (see `functions_incremental.read_new_rows`), saves it and returns it. A day of new data costs the time of that
+    day only. A rewritten file is trained on again from its start, the rows seen before cannot be unlearned.
+    """
+    urls = sorted(glob.glob(urls)) if isinstance(urls, str) else list(urls)
+    model = load_click_model(model_dir)
+
+    for url in urls:
+        key = os.path.abspath(url)
+        df, model['watermarks'][key], _ = read_new_rows(url, model['watermarks'].get(key))
+        if df is not None:
+            partial_fit_clicks(model, df, batch_size)
+
+    save_click_model(model, model_dir)
+    return model
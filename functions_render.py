@@ -0,0 +1,203 @@
+import argparse
+import glob
+import hashlib
+import os
+import pickle
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import numpy as np
+from functions_cache import code_version
+from functions_trace import span, trace_summary, tracing, write_spans
+
+
+def chart_data(func):
+    """
+    This function returns the function that computes the data drawn by the chart function `func`, the function
+    named like it with a `_data` suffix in its module (e.g. `site_purchases_by_age_data`), or None if there is none.
+    """
+    module = sys.modules.get(func.__module__)
+    data = getattr(module, f'{func.__name__}_data', None)
+    return data if callable(data) else None
+
+def update_digest(digest, value):
+    """
+    This function adds `value` to the hash `digest`: DataFrames, Series and arrays by content, tuples and lists
+    item by item, other values pickled.
+    """
+    if isinstance(value, pd.DataFrame):
+        # hash the values, the index, the column names and the dtypes of the frame
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+        digest.update(repr(list(zip(value.columns, value.dtypes.astype(str)))).encode('utf-8'))
+    elif isinstance(value, pd.Series):
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+        digest.update(repr((value.name, str(value.dtype))).encode('utf-8'))
+    elif isinstance(value, np.ndarray):
+        # hash the content and the layout of the array
+        digest.update(np.ascontiguousarray(value).tobytes())
+        digest.update(repr((value.shape, value.dtype.str)).encode('utf-8'))
+    elif isinstance(value, (tuple, list)):
+        digest.update(f'{type(value).__name__}:{len(value)}'.encode('utf-8'))
+        for item in value:
+            update_digest(digest, item)
+    else:
+        digest.update(pickle.dumps(value))
+
+def input_hash(func, args):
+    """
+    This function returns a hash of the chart function `func`, its code (see `functions_cache.code_version`) and
+    what it draws: the output of its data function (see `chart_data`) when it has one, its inputs (`args`) otherwise.
+    Data is hashed by content, so the hash only changes when the chart code or the data behind the chart changes,
+    not when unused columns or rows of the inputs do.
+    """
+    digest = hashlib.sha256(f'{func.__module__}.{func.__qualname__}:{code_version(func)}'.encode('utf-8'))
+
+    data = chart_data(func)
+    update_digest(digest, data(*args) if data is not None else list(args))
+
+    return digest.hexdigest()
+
+def use_agg():
+    """
+    This function switches matplotlib to the non-interactive Agg backend, the initializer of the worker processes
+    that render charts (it closes the figures of the process, so it is never called in the caller's process).
+    """
+    import matplotlib.pyplot as plt
+    plt.switch_backend('Agg')
+
+def render_chart(job):
+    """
+    This function takes a job (`func`, `args`, `path`, `dpi`), draws the chart with `func(*args)` on a new figure
+    and saves it to `path` (PNG or SVG, from the extension). Returns the path of the image.
+    The pyplot state of the caller (e.g. a notebook) is kept: the backend is not changed, `plt.show()` does nothing
+    while drawing, only the figures opened by the chart are closed and the current figure is restored.
+    """
+    func, args, path, dpi = job
+    import matplotlib.pyplot as plt
+
+    # remember the figures of the caller
+    before = set(plt.get_fignums())
+    current = plt.gcf().number if before else None
+    show = plt.show
+    plt.show = lambda *_, **__: None
+
+    try:
+        # draw the chart on a new figure and save the current figure
+        plt.figure()
+        func(*args)
+        with span('savefig', 'render'):
+            plt.gcf().savefig(path, dpi=dpi)
+    finally:
+        plt.show = show
+        for number in set(plt.get_fignums()) - before:
+            plt.close(number)
+        if current is not None:
+            plt.figure(current)
+
+    return path
+
+def render_charts(charts, out_dir, fmt='png', workers=None, dpi=100):
+    """
+    This function renders the charts of `charts` (a dict name -> (function, *args), e.g.
+    `{'click_by_category': (click_by_category, cube)}`) to `fmt` ('png' or 'svg') files in `out_dir`,
+    in a pool of `workers` processes (all the cores by default, 1 renders in the current process).
+    Images are named after the hash of the chart code and data (see `input_hash`), so charts whose code and data did
+    not change are not redrawn. Passing aggregated inputs (e.g. a click cube) keeps the hashing cheap.
+    Returns a dict name -> path of the image.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {}
+    jobs = []
+
+    for name, (func, *args) in charts.items():
+        # the image of the chart is named after its inputs
+        path = os.path.join(out_dir, f'{name}-{input_hash(func, args)[:16]}.{fmt}')
+        paths[name] = path
+
+        # skip the charts that are already rendered
+        if os.path.exists(path):
+            continue
+
+        # remove the images of older inputs of the same chart
+        for old_path in glob.glob(os.path.join(glob.escape(out_dir), f'{glob.escape(name)}-*.{fmt}')):
+            os.remove(old_path)
+
+        jobs.append((func, args, path, dpi))
+
+    # render the charts, in the current process when there is a single worker
+    if workers == 1 or len(jobs) <= 1:
+        for job in jobs:
+            render_chart(job)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=use_agg) as pool:
+            list(pool.map(render_chart, jobs))
+
+    return paths
+
+def notebook_charts(datasets_dir='datasets'):
+    """
+    This function loads and cleans the three datasets as `main.ipynb` does and returns the dict of
+    all the charts of the notebook, ready for `render_charts`.
+    """
+    import functions_click as fc
+    import functions_marketing as fm
+    import functions_product as fp
+
+    # consumers survey
+    with span('read_excel', 'load') as step:
+        df_product = pd.read_excel(os.path.join(datasets_dir, 'consumers.xls'))
+        step.rows_out = len(df_product)
+    df_both, df_men, df_women = fp.clean_df_product(df_product)
+
+    # marketing campaign
+    with span('read_excel', 'load') as step:
+        df_marketing = pd.read_excel(os.path.join(datasets_dir, 'marketing_campaign.xlsx'))
+        step.rows_out = len(df_marketing)
+    df = fm.clean_df_marketing(df_marketing)
+    df_wine = df[df['MntWines'] > 200]
+    df_income = df[(df['Income'] < 110000) & (df['Income'] > 15000)]
+
+    # ads clicking, the click charts only need the count cube
+    cube = fc.click_cube_chunks(fc.read_click_chunks(os.path.join(datasets_dir, 'adsclicking.csv')))
+
+    return {
+        'consume_wine': (fp.consume_wine, df_both),
+        'consume_m_w_by_age': (fp.consume_m_w_by_age, df_men, df_women),
+        'consume_men_women': (fp.consume_men_women, df_men, df_women),
+        'consume_by_age': (fp.consume_by_age, df_both),
+        'site_purchases_by_age': (fm.site_purchases_by_age, df_wine),
+        'site_purchases_by_income': (fm.site_purchases_by_income, df_wine),
+        'web_visits_by_age': (fm.web_visits_by_age, df_wine),
+        'income_by_ages': (fm.income_by_ages, df),
+        'purchases_by_income': (fm.purchases_by_income, df_income),
+        'purchases_by_income_line': (fm.purchases_by_income_line, df_income),
+        'purchases_by_education': (fm.purchases_by_education, df),
+        'son_at_home': (fm.son_at_home, df),
+        'purchases_by_living_status': (fm.purchases_by_living_status, df),
+        'purchases_by_month': (fm.purchases_by_month, df),
+        'click_by_category': (fc.click_by_category, cube),
+        'click_by_category_income': (fc.click_by_category_income, cube),
+        'click_by_category_age': (fc.click_by_category_age, cube),
+    }
+
+if __name__ == '__main__':
+    # render all the charts of the notebook without a display
+    parser = argparse.ArgumentParser(description='Render all the charts of the report to image files.')
+    parser.add_argument('out_dir', help='directory of the images')
+    parser.add_argument('--datasets', default='datasets', help='directory of the datasets')
+    parser.add_argument('--format', default='png', choices=['png', 'svg'], help='image format')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (all the cores by default)')
+    parser.add_argument('--trace', default=None, help='JSON lines file of the traced steps (renders in one process)')
+    args = parser.parse_args()
+
+    if args.trace:
+        # trace the whole run in the current process, the spans of worker processes are not collected
+        with tracing() as spans:
+            paths = render_charts(notebook_charts(args.datasets), args.out_dir, args.format, workers=1)
+        write_spans(args.trace, spans)
+        print(trace_summary(spans).to_string())
+    else:
+        paths = render_charts(notebook_charts(args.datasets), args.out_dir, args.format, args.workers)
+
+    for name, path in paths.items():
+        print(f'{name}: {path}')
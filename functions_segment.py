@@ -0,0 +1,176 @@
+import time
+import numpy as np
+import pandas as pd
+
+# columns of the cleaned marketing frame the customers are clustered on
+SEGMENT_FEATURES = ['Income', 'Age', 'MntWines', 'NumWebPurchases', 'NumCatalogPurchases', 'NumStorePurchases',
+                    'NumDealsPurchases', 'NumWebVisitsMonth']
+
+
+def feature_matrix(df, features=SEGMENT_FEATURES):
+    """
+    This function returns the `features` columns of the pandas DataFrame `df` as a float64 array, one row per
+    customer, with NaN for missing values.
+    """
+    return np.column_stack([df[column].to_numpy(dtype='float64', na_value=np.nan) for column in features])
+
+def feature_moments(x):
+    """
+    This function returns the count, the mean and the centered sum of squares of every column of the array `x`
+    (missing values left out), as an array of shape (3, columns) that chunks can merge (see `merge_moments`).
+    """
+    valid = ~np.isnan(x)
+    n = valid.sum(axis=0).astype('float64')
+    mean = np.divide(np.where(valid, x, 0).sum(axis=0), n, out=np.zeros(x.shape[1]), where=n > 0)
+    m2 = np.where(valid, (x - mean) ** 2, 0).sum(axis=0)
+    return np.array([n, mean, m2])
+
+def merge_moments(a, b):
+    """
+    This function merges the moments `a` and `b` of two chunks (see `feature_moments`), column by column, with the
+    pairwise update of the centered sums.
+    """
+    n = a[0] + b[0]
+    delta = b[1] - a[1]
+    share = np.divide(b[0], n, out=np.zeros_like(n), where=n > 0)
+    return np.array([n, a[1] + delta * share, a[2] + b[2] + delta * delta * a[0] * share])
+
+def feature_scaler(chunks, features=SEGMENT_FEATURES):
+    """
+    This function takes an iterable of cleaned marketing DataFrames (`chunks`) and returns the mean and the standard
+    deviation of every feature, in one pass over the data. Constant features get a standard deviation of 1.
+    """
+    moments = np.zeros((3, len(features)))
+    for chunk in chunks:
+        moments = merge_moments(moments, feature_moments(feature_matrix(chunk, features)))
+
+    std = np.sqrt(np.divide(moments[2], moments[0], out=np.zeros(len(features)), where=moments[0] > 0))
+    return moments[1], np.where(std > 0, std, 1.0)
+
+def standardize(x, mean, scale):
+    """
+    This function standardizes the rows of `x` with `mean` and `scale`, missing values become 0 (the mean).
+    """
+    z = (x - mean) / scale
+    z[np.isnan(z)] = 0.0
+    return z
+
+def nearest_centers(z, centers):
+    """
+    This function returns the index of the nearest of `centers` to every row of `z` and the squared distance.
+    """
+    # |z - c|^2 = |z|^2 - 2 z.c + |c|^2, with one matrix product
+    distances = (z * z).sum(axis=1)[:, None] - 2 * z @ centers.T + (centers * centers).sum(axis=1)[None, :]
+    nearest = distances.argmin(axis=1)
+    return nearest, np.maximum(distances[np.arange(len(z)), nearest], 0)
+
+def init_centers(z, k, rng):
+    """
+    This function picks `k` initial centers among the rows of `z` with k-means++: each new center is drawn with a
+    probability proportional to the squared distance to the nearest center already picked.
+    """
+    if len(z) < k:
+        raise ValueError(f'The first chunk has {len(z)} customers, at least {k} are needed to start {k} segments')
+
+    centers = [z[rng.integers(len(z))]]
+    distances = ((z - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        total = distances.sum()
+        index = rng.choice(len(z), p=distances / total) if total > 0 else rng.integers(len(z))
+        centers.append(z[index])
+        distances = np.minimum(distances, ((z - z[index]) ** 2).sum(axis=1))
+
+    return np.array(centers)
+
+def fit_segments(chunks, k=5, batch_size=1024, scaler=None, features=SEGMENT_FEATURES, random_state=0):
+    """
+    This function clusters customers into `k` segments with mini-batch k-means, reading the cleaned marketing
+    DataFrames of `chunks` (e.g. from `clean_df_marketing_chunks`) once, so the memory is bounded by the chunk size.
+    Features are standardized with `scaler` (mean, std), from `feature_scaler` over all the data for the best
+    result, or from the first chunk by default. Centers start with k-means++ on the first chunk, then each batch of
+    `batch_size` customers moves every center towards its customers with a per-center rate of 1 / (customers seen).
+    Returns the model, a dict with the features, the scaler, the standardized centers, the customers seen by each
+    center, the rows read, the fit time and the throughput in rows per second.
+    """
+    rng = np.random.default_rng(random_state)
+    start = time.perf_counter()
+    centers = counts = mean = scale = None
+    rows = 0
+
+    for chunk in chunks:
+        x = feature_matrix(chunk, features)
+        if len(x) == 0:
+            continue
+
+        # start from the first chunk
+        if centers is None:
+            mean, scale = scaler if scaler is not None else feature_scaler([chunk], features)
+            centers = init_centers(standardize(x, mean, scale), k, rng)
+            counts = np.zeros(k)
+
+        # visit the customers of the chunk in a random order, one batch at a time
+        z = standardize(x, mean, scale)[rng.permutation(len(x))]
+        for batch_start in range(0, len(z), batch_size):
+            batch = z[batch_start:batch_start + batch_size]
+            nearest, _ = nearest_centers(batch, centers)
+
+            # move each center to the running mean of all the customers it has seen
+            batch_counts = np.bincount(nearest, minlength=k)
+            sums = np.zeros_like(centers)
+            np.add.at(sums, nearest, batch)
+            counts += batch_counts
+            seen = batch_counts > 0
+            centers[seen] += (sums[seen] - batch_counts[seen, None] * centers[seen]) / counts[seen, None]
+
+        rows += len(x)
+
+    if centers is None:
+        raise ValueError('No customers to segment')
+
+    seconds = time.perf_counter() - start
+    return {
+        'features': list(features),
+        'mean': mean,
+        'scale': scale,
+        'centers': centers,
+        'counts': counts,
+        'rows': rows,
+        'seconds': seconds,
+        'rows_per_second': rows / seconds if seconds > 0 else np.inf,
+    }
+
+def assign_segments(df, model, batch_size=100000):
+    """
+    This function returns the segment of every customer of the pandas DataFrame `df` under the fitted `model` (see
+    `fit_segments`) as an int array, computed in vectorized batches of `batch_size` customers.
+    """
+    x = feature_matrix(df, model['features'])
+    segments = np.empty(len(x), dtype='int32')
+
+    for batch_start in range(0, len(x), batch_size):
+        batch = standardize(x[batch_start:batch_start + batch_size], model['mean'], model['scale'])
+        segments[batch_start:batch_start + batch_size] = nearest_centers(batch, model['centers'])[0]
+
+    return segments
+
+def segment_inertia(chunks, model):
+    """
+    This function returns the mean squared standardized distance of the customers of `chunks` to their segment
+    center, to compare fits (e.g. with different `k`) in one pass over the data.
+    """
+    total, rows = 0.0, 0
+    for chunk in chunks:
+        z = standardize(feature_matrix(chunk, model['features']), model['mean'], model['scale'])
+        total += nearest_centers(z, model['centers'])[1].sum()
+        rows += len(z)
+    return total / rows if rows else np.nan
+
+def segment_profiles(model):
+    """
+    This function returns a pandas DataFrame with the center of every segment of `model` in the units of the
+    features (e.g. income in euros) and the number of customers the segment has seen while fitting.
+    """
+    profiles = pd.DataFrame(model['centers'] * model['scale'] + model['mean'], columns=model['features'])
+    profiles.index.name = 'Segment'
+    profiles['Customers'] = model['counts'].astype('int64')
+    return profiles
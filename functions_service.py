@@ -0,0 +1,244 @@
+import argparse
+import asyncio
+import json
+import re
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlsplit
+import numpy as np
+import pandas as pd
+from functions_aggregate import group_aggregate
+from functions_cache import read_excel_cached
+from functions_click import AGE_LABELS, INCOME_LABELS, INTEREST_CATEGORIES, click_cube_chunks, read_click_chunks
+from functions_marketing import clean_df_marketing
+from functions_pipeline import OPERATORS, filter_mask
+from functions_product import load_consumers
+
+# maximum number of answers kept by the result cache
+RESULT_CACHE_SIZE = 1024
+
+# filters of the /mean endpoint, e.g. filter=MntWines>200
+FILTER_PATTERN = re.compile(r'^(\w+)(<=|>=|==|!=|<|>)(.+)$')
+
+
+def load_datasets(datasets_dir='datasets', cache_dir='.cache'):
+    """
+    This function loads and cleans the three datasets once and returns the in-memory state of the service:
+    the click cube, the cleaned marketing frame and the long-format consumers survey.
+    """
+    return {
+        'cube': click_cube_chunks(read_click_chunks(f'{datasets_dir}/adsclicking.csv')),
+        'marketing': read_excel_cached(f'{datasets_dir}/marketing_campaign.xlsx', clean_df_marketing, cache_dir=cache_dir),
+        'consumers': load_consumers(f'{datasets_dir}/consumers.xls'),
+    }
+
+def parse_value(text):
+    """
+    This function turns the text of a filter value into a number when it is one.
+    """
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+def records(df):
+    """
+    This function turns a pandas DataFrame into a list of JSON-ready dicts, with missing values as null.
+    """
+    return json.loads(df.to_json(orient='records'))
+
+def query_click_rate(state, params):
+    """
+    This function answers /click_rate: the percentage of clicks of each interest category, optionally restricted to
+    an `income_range` and an `age_range` (labels of the click bins), read from the click cube.
+    """
+    cube = state['cube']
+
+    # select the slots of the requested ranges (all of them, even out of the bins, by default)
+    income = slice(None) if 'income_range' not in params else INCOME_LABELS.index(params['income_range'])
+    age = slice(None) if 'age_range' not in params else AGE_LABELS.index(params['age_range'])
+    counts = cube[income, age].reshape(-1, len(INTEREST_CATEGORIES), 2).sum(axis=0)
+
+    total = counts.sum(axis=1)
+    percentage = np.divide(counts[:, 1], total, out=np.full(total.shape, np.nan), where=total > 0) * 100
+    return records(pd.DataFrame({'Interest_Category': INTEREST_CATEGORIES, 'Total': total, 'Clicks': counts[:, 1], 'Percentage_Click': percentage}))
+
+def query_mean(state, params, filters):
+    """
+    This function answers /mean: the mean of `measure` (MntWines by default) for each group of `by` over the
+    marketing customers that pass the `filters` (e.g. filter=Income>15000).
+    """
+    df = state['marketing']
+    if filters:
+        df = df[filter_mask(df, filters)]
+
+    result = group_aggregate(df, params['by'], params.get('measure', 'MntWines'), observed=True)
+    return records(result.reset_index().astype({params['by']: str}))
+
+def query_consumers(state, params):
+    """
+    This function answers /consumers: the rows of the consumers survey, optionally for one `sex` (both, men, women).
+    """
+    df = state['consumers']
+    if 'sex' in params:
+        df = df[df['sex'] == params['sex']]
+    return records(df)
+
+def answer(state, target):
+    """
+    This function answers the request `target` (path and query string) and returns the HTTP status and the JSON body.
+    """
+    url = urlsplit(target)
+    pairs = parse_qsl(url.query)
+    params = {name: value for name, value in pairs if name != 'filter'}
+
+    # parse the filters of the query
+    filters = []
+    for name, value in pairs:
+        if name == 'filter':
+            match = FILTER_PATTERN.match(value)
+            if match is None or match.group(2) not in OPERATORS:
+                return 400, {'error': f'Invalid filter: {value!r}'}
+            filters.append((match.group(1), match.group(2), parse_value(match.group(3))))
+
+    try:
+        if url.path == '/health':
+            return 200, {'status': 'ok'}
+        if url.path == '/click_rate':
+            return 200, {'rows': query_click_rate(state, params)}
+        if url.path == '/mean':
+            return 200, {'rows': query_mean(state, params, filters)}
+        if url.path == '/consumers':
+            return 200, {'rows': query_consumers(state, params)}
+    except (KeyError, ValueError, TypeError) as error:
+        # unknown columns or labels, and filter values of the wrong type for their column (e.g. Income>abc)
+        return 400, {'error': f'Invalid query: {error}'}
+
+    return 404, {'error': f'Unknown path: {url.path}'}
+
+def make_handler(state):
+    """
+    This function returns the asyncio connection handler of the service, with a LRU cache of the answers.
+    Connections are kept alive between requests.
+    """
+    cache = OrderedDict()
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                # read the request line and the headers
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3 or parts[0] != 'GET':
+                    status, body = 405, json.dumps({'error': 'Only GET is supported'}).encode('utf-8')
+                else:
+                    # serve the answer from the cache or compute it
+                    target = parts[1]
+                    if target in cache:
+                        cache.move_to_end(target)
+                        status, body = cache[target]
+                    else:
+                        status, payload = answer(state, target)
+                        body = json.dumps(payload).encode('utf-8')
+                        if status == 200:
+                            cache[target] = (status, body)
+                            while len(cache) > RESULT_CACHE_SIZE:
+                                cache.popitem(last=False)
+
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(f'HTTP/1.1 {status} {"OK" if status == 200 else "Error"}\r\n'
+                             f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n'
+                             f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode('latin-1') + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return handle
+
+async def serve(host='127.0.0.1', port=8765, datasets_dir='datasets'):
+    """
+    This function loads the datasets (see `load_datasets`) and serves the queries on `host`:`port` until cancelled.
+    """
+    state = load_datasets(datasets_dir)
+    server = await asyncio.start_server(make_handler(state), host, port)
+    print(f'Serving on http://{host}:{port}', flush=True)
+    async with server:
+        await server.serve_forever()
+
+async def load_test(host='127.0.0.1', port=8765, paths=None, concurrency=16, requests=2000):
+    """
+    This function sends `requests` GET requests over `concurrency` keep-alive connections to the service, cycling
+    through `paths`, and returns the number of requests, the throughput and the p50/p99 latencies in milliseconds.
+    """
+    paths = paths or [
+        '/click_rate',
+        '/click_rate?income_range=40k-60k',
+        '/click_rate?age_range=25-34',
+        '/mean?by=Living_Status',
+        '/mean?by=Age_Range&measure=NumWebVisitsMonth&filter=MntWines>200',
+        '/mean?by=Education_Level&filter=Income>15000&filter=Income<110000',
+        '/consumers?sex=women',
+    ]
+    latencies = []
+
+    async def client(worker):
+        reader, writer = await asyncio.open_connection(host, port)
+        for i in range(worker, requests, concurrency):
+            path = paths[i % len(paths)]
+            start = time.perf_counter()
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode('latin-1'))
+            await writer.drain()
+
+            # read the headers and the body of the answer
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':')[1])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(worker) for worker in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'requests_per_sec': len(latencies) / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'max_ms': float(latencies.max()),
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Aggregation query service for the dashboard.')
+    parser.add_argument('command', choices=['serve', 'loadtest'], help='run the service or load-test a running one')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--datasets', default='datasets', help='directory of the datasets')
+    parser.add_argument('--concurrency', type=int, default=16, help='connections of the load test')
+    parser.add_argument('--requests', type=int, default=2000, help='requests of the load test')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        asyncio.run(serve(args.host, args.port, args.datasets))
+    else:
+        print(json.dumps(asyncio.run(load_test(args.host, args.port, concurrency=args.concurrency, requests=args.requests)), indent=2))
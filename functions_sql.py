@@ -0,0 +1,294 @@
+import numpy as np
+import pandas as pd
+from functions_click import AGE_LABELS as CLICK_AGE_LABELS, AGE_SCHEME as CLICK_AGE_SCHEME, CLICK_COLUMNS, CUBE_SHAPE
+from functions_click import INCOME_LABELS as CLICK_INCOME_LABELS, INCOME_SCHEME as CLICK_INCOME_SCHEME, INTEREST_CATEGORIES
+from functions_dates import ROLLUP_MEASURES, detect_date_format, parse_dates, rollups_from_daily
+from functions_marketing import AGE_LABELS, AGE_SCHEME, DROP_COLUMNS, EDUCATION_LEVELS, INCOME_LABELS, INCOME_SCHEME
+from functions_marketing import LIVING_STATUS, read_excel_chunks
+from functions_pipeline import OPERATORS
+from functions_regression import ols_stats
+
+# labels of the range columns of each view, they are categorical in the cleaned pandas DataFrames
+VIEW_CATEGORIES = {
+    'marketing': {'Age_Range': AGE_LABELS, 'Income_Range': INCOME_LABELS},
+    'click': {'Income_Range': CLICK_INCOME_LABELS, 'Age_Range': CLICK_AGE_LABELS},
+}
+
+
+def quote(name):
+    """
+    This function quotes a table or column name for SQL.
+    """
+    return '"' + str(name).replace('"', '""') + '"'
+
+def literal(value):
+    """
+    This function writes a string or a number as a SQL literal.
+    """
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return repr(value)
+
+def mapping_case(column, mapping):
+    """
+    This function returns the SQL expression mapping the values of `column` with the dict `mapping`, like
+    `Series.replace`: values missing from `mapping` are kept.
+    """
+    branches = ' '.join(f'WHEN {literal(old)} THEN {literal(new)}' for old, new in mapping.items())
+    return f'CASE {quote(column)} {branches} ELSE {quote(column)} END'
+
+def bins_case(column, scheme):
+    """
+    This function returns the SQL expression binning `column` into the labels of the bin scheme `scheme`, like
+    `functions_bins.bin_series`. Values outside the bins (and missing values) are NULL.
+    """
+    column = quote(column)
+    branches = []
+    for i, label in enumerate(scheme.labels):
+        low, high = scheme.edges[i], scheme.edges[i + 1]
+        if scheme.right:
+            condition = f'{column} {">=" if scheme.include_lowest and i == 0 else ">"} {low} AND {column} <= {high}'
+        else:
+            condition = f'{column} >= {low} AND {column} < {high}'
+        branches.append(f'WHEN {condition} THEN {literal(label)}')
+    return f'CASE {" ".join(branches)} ELSE NULL END'
+
+def table_columns(connection, table):
+    """
+    This function returns the column names of a table or a view of the database.
+    """
+    return [row[1] for row in connection.execute(f'PRAGMA table_info({quote(table)})')]
+
+def create_marketing_view(connection):
+    """
+    This function creates the `marketing` view over the raw `marketing_raw` table, with the cleaning of
+    `clean_df_marketing`: duplicated rows dropped, education levels and living statuses mapped, age (from the
+    customer date) and parent status computed, customers of 100 years or more dropped, age and income ranges binned
+    and the unused columns left out. Rows added to the raw table later are seen by the view.
+    """
+    kept = [column for column in table_columns(connection, 'marketing_raw') if column not in DROP_COLUMNS]
+
+    connection.execute(f"""
+        CREATE VIEW IF NOT EXISTS marketing AS
+        SELECT {', '.join(quote(column) for column in kept)},
+               {mapping_case('Education', EDUCATION_LEVELS)} AS Education_Level,
+               {mapping_case('Marital_Status', LIVING_STATUS)} AS Living_Status,
+               Age,
+               Is_Parent,
+               {bins_case('Age', AGE_SCHEME)} AS Age_Range,
+               {bins_case('Income', INCOME_SCHEME)} AS Income_Range
+        FROM (
+            SELECT *,
+                   CAST(strftime('%Y', Dt_Customer) AS INTEGER) - Year_Birth AS Age,
+                   CAST(COALESCE(Kidhome + Teenhome > 0, 0) AS INTEGER) AS Is_Parent
+            FROM (SELECT DISTINCT * FROM marketing_raw)
+        )
+        WHERE Age < 100
+    """)
+
+def create_click_view(connection):
+    """
+    This function creates the `click` view over the raw `click_raw` table, with the income and age ranges of
+    `clean_df_click`.
+    """
+    connection.execute(f"""
+        CREATE VIEW IF NOT EXISTS click AS
+        SELECT {', '.join(quote(column) for column in CLICK_COLUMNS)},
+               {bins_case('Income', CLICK_INCOME_SCHEME)} AS Income_Range,
+               {bins_case('Age', CLICK_AGE_SCHEME)} AS Age_Range
+        FROM click_raw
+    """)
+
+def load_marketing_sql(connection, url, chunksize=100000, date_format=None):
+    """
+    This function appends the rows of the marketing workbook `url` to the raw table of the SQLite `connection`
+    (e.g. `sqlite3.connect('marketing.db')` to keep it on disk), reading it in chunks of `chunksize` rows,
+    creates the cleaned `marketing` view and returns it as a SqlFrame. Customer dates are stored as ISO text, their
+    format (`date_format`) is detected from the first chunk by default, a later chunk with dates of another format
+    raises a ValueError (see `clean_df_marketing_chunks`).
+    """
+    for chunk in read_excel_chunks(url, chunksize):
+        chunk.columns = chunk.columns.str.strip()
+        if date_format is None and len(chunk) > 0:
+            date_format = detect_date_format(chunk['Dt_Customer'])
+        chunk['Dt_Customer'] = parse_dates(chunk['Dt_Customer'], date_format).dt.strftime('%Y-%m-%d')
+        chunk.to_sql('marketing_raw', connection, if_exists='append', index=False)
+
+    create_marketing_view(connection)
+    connection.commit()
+    return SqlFrame(connection, 'marketing')
+
+def load_click_sql(connection, urls, chunksize=100000):
+    """
+    This function appends the rows of the ads clicking CSV files `urls` (a path or a list of paths) to the raw table
+    of the SQLite `connection`, parsing only the columns kept by the cleaning, creates the cleaned `click` view
+    and returns it as a SqlFrame.
+    """
+    urls = [urls] if isinstance(urls, str) else list(urls)
+
+    for url in urls:
+        for chunk in pd.read_csv(url, usecols=CLICK_COLUMNS, chunksize=chunksize):
+            chunk.to_sql('click_raw', connection, if_exists='append', index=False)
+
+    create_click_view(connection)
+    connection.commit()
+    return SqlFrame(connection, 'click')
+
+class SqlFrame:
+    """
+    A cleaned view of a SQLite database (see `load_marketing_sql` and `load_click_sql`), with optional row filters.
+    The plotting functions take it in place of a cleaned pandas DataFrame: their aggregations run as SQL queries
+    and only the small results are read into pandas, in the same form as the pandas aggregations.
+    """
+
+    def __init__(self, connection, view, filters=()):
+        self.connection = connection
+        self.view = view
+        self.filters = tuple(filters)
+        self.categories = VIEW_CATEGORIES.get(view, {})
+        self.columns = table_columns(connection, view)
+
+    def __repr__(self):
+        return f'SqlFrame(view={self.view!r}, filters={list(self.filters)})'
+
+    def __len__(self):
+        return self.query(f'SELECT COUNT(*) FROM {quote(self.view)}')[0][0]
+
+    def __getitem__(self, column):
+        return self.to_pandas([column])[column]
+
+    def filter(self, column, op, value):
+        """
+        This method returns a new SqlFrame that keeps only the rows where `column` `op` `value` (op is one of
+        `OPERATORS`), like `df[df[column] op value]`.
+        """
+        if column not in self.columns:
+            raise KeyError(column)
+        if op not in OPERATORS:
+            raise ValueError(f'Unknown operator: {op!r}, expected one of {list(OPERATORS)}')
+        return SqlFrame(self.connection, self.view, self.filters + ((column, op, value),))
+
+    def query(self, sql, conditions=()):
+        """
+        This method runs `sql` (a SELECT over the view, without WHERE) with the filters of the frame and the extra
+        `conditions` (SQL strings) and returns the rows. Clauses after the WHERE can follow a `{where}` placeholder.
+        """
+        clauses, params = list(conditions), []
+        for column, op, value in self.filters:
+            # missing values pass `!=` in pandas, they would not in SQL
+            clause = f'{quote(column)} {op} ?'
+            clauses.append(f'({clause} OR {quote(column)} IS NULL)' if op == '!=' else clause)
+            params.append(value.item() if isinstance(value, np.generic) else value)
+
+        where = f' WHERE {" AND ".join(clauses)}' if clauses else ''
+        sql = sql.replace('{where}', where) if '{where}' in sql else sql + where
+        return self.connection.execute(sql, params).fetchall()
+
+    def to_pandas(self, columns=None):
+        """
+        This method reads the rows of the frame (`columns`, all by default) into a pandas DataFrame.
+        """
+        columns = self.columns if columns is None else columns
+        rows = self.query(f'SELECT {", ".join(quote(column) for column in columns)} FROM {quote(self.view)}')
+        return pd.DataFrame.from_records(rows, columns=columns)
+
+    def group_stats(self, key, measures):
+        """
+        This method computes, for every group of the column `key`, the sum and the count of non-missing values of
+        `measures` (a column name or a list) with one GROUP BY query, and returns them like
+        `functions_aggregate.group_stats`: all the labels of a range column, the sorted distinct values otherwise.
+        """
+        measures = [measures] if isinstance(measures, str) else list(measures)
+        aggregates = ', '.join(f'SUM({quote(column)}), COUNT({quote(column)})' for column in measures)
+        rows = self.query(f'SELECT {quote(key)}, COUNT(*), {aggregates} FROM {quote(self.view)}{{where}} GROUP BY 1',
+                          [f'{quote(key)} IS NOT NULL'])
+
+        # index the results by the groups, like the group codes of pandas
+        if key in self.categories:
+            labels = self.categories[key]
+            groups = pd.CategoricalIndex(labels, categories=labels, ordered=True, name=key)
+        else:
+            groups = pd.Index(sorted(row[0] for row in rows), name=key)
+        position = {value: i for i, value in enumerate(groups)}
+
+        # fill the groups without rows with zeros
+        size = np.zeros(len(groups), dtype='int64')
+        sums = np.zeros((len(groups), len(measures)), dtype='float64')
+        counts = np.zeros((len(groups), len(measures)), dtype='int64')
+        for row in rows:
+            i = position[row[0]]
+            size[i] = row[1]
+            sums[i] = [value or 0 for value in row[2::2]]
+            counts[i] = row[3::2]
+
+        return {
+            'sum': pd.DataFrame(sums, index=groups, columns=measures),
+            'count': pd.DataFrame(counts, index=groups, columns=measures),
+            'size': pd.Series(size, index=groups),
+        }
+
+    def click_cube(self):
+        """
+        This method counts the rows of the `click` view with one GROUP BY query into the click cube
+        (see `functions_click.click_cube`).
+        """
+        rows = self.query(f'SELECT Income_Range, Age_Range, Interest_Category, Click, COUNT(*) '
+                          f'FROM {quote(self.view)}{{where}} GROUP BY 1, 2, 3, 4')
+
+        # the cube has a fixed layout, so unknown categories cannot be counted
+        unknown = sorted({str(row[2]) for row in rows if row[2] not in INTEREST_CATEGORIES})
+        if unknown:
+            raise ValueError(f'Unknown interest categories: {unknown}')
+
+        # rows outside the bins go to the last slot
+        cube = np.zeros(CUBE_SHAPE, dtype='int64')
+        for income, age, category, click, count in rows:
+            cube[CLICK_INCOME_LABELS.index(income) if income is not None else -1,
+                 CLICK_AGE_LABELS.index(age) if age is not None else -1,
+                 INTEREST_CATEGORIES.index(category), int(click)] += count
+
+        return cube
+
+    def date_rollups(self, date='Dt_Customer', measures=None):
+        """
+        This method computes the daily totals of `measures` (`ROLLUP_MEASURES` by default) and the number of
+        customers with one GROUP BY query, and returns the rollups like `functions_dates.date_rollups`.
+        """
+        measures = ROLLUP_MEASURES if measures is None else list(measures)
+        totals = ', '.join(f'COALESCE(SUM({quote(column)}), 0)' for column in measures)
+        rows = self.query(f'SELECT date({quote(date)}), {totals}, COUNT(*) FROM {quote(self.view)}{{where}} '
+                          f'GROUP BY 1 ORDER BY 1', [f'{quote(date)} IS NOT NULL'])
+
+        daily = pd.DataFrame.from_records(rows, columns=[date] + measures + ['Customers'])
+        return rollups_from_daily(daily.set_index(pd.DatetimeIndex(pd.to_datetime(daily.pop(date)), name=date)))
+
+    def ols_stats(self, x='Income', y='MntWines'):
+        """
+        This method computes the sufficient statistics of the regression of column `y` on column `x`
+        (see `functions_regression.ols_stats`) with two queries: the means, then the centered sums.
+        """
+        complete = [f'{quote(x)} IS NOT NULL', f'{quote(y)} IS NOT NULL']
+        n, mean_x, mean_y, min_x, max_x = self.query(f'SELECT COUNT(*), AVG({quote(x)}), AVG({quote(y)}), MIN({quote(x)}), '
+                                                     f'MAX({quote(x)}) FROM {quote(self.view)}', complete)[0]
+        if n == 0:
+            return ols_stats([], [])
+
+        # center the values on the means
+        dx, dy = f'({quote(x)} - {mean_x!r})', f'({quote(y)} - {mean_y!r})'
+        sxx, sxy, syy = self.query(f'SELECT SUM({dx} * {dx}), SUM({dx} * {dy}), SUM({dy} * {dy}) FROM {quote(self.view)}',
+                                   complete)[0]
+
+        return np.array([n, mean_x, mean_y, sxx, sxy, syy, min_x, max_x], dtype='float64')
+
+    def pair_counts(self, x='Income', y='MntWines'):
+        """
+        This method returns the distinct complete pairs of columns `x` and `y` and the number of rows of each,
+        as three arrays, e.g. to draw a 2D histogram with the counts as weights.
+        """
+        rows = self.query(f'SELECT {quote(x)}, {quote(y)}, COUNT(*) FROM {quote(self.view)}{{where}} GROUP BY 1, 2',
+                          [f'{quote(x)} IS NOT NULL', f'{quote(y)} IS NOT NULL'])
+        if not rows:
+            return np.array([]), np.array([]), np.array([])
+
+        x_values, y_values, counts = zip(*rows)
+        return np.array(x_values, dtype='float64'), np.array(y_values, dtype='float64'), np.array(counts, dtype='float64')
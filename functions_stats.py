@@ -0,0 +1,198 @@
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+from functions_click import INTEREST_CATEGORIES, click_cube, cube_rollup
+
+# coefficients of the Chebyshev fit of erfc (Numerical Recipes `erfcc`, fractional error below 1.2e-7)
+ERFC_COEFFICIENTS = [-1.26551223, 1.00002368, 0.37409196, 0.09678418, -0.18628806, 0.27886807, -1.13520398,
+                     1.48851587, -0.82215223, 0.17087277]
+
+
+def erfc(x):
+    """
+    This function returns the complementary error function of every value of `x` (an array), numpy has no ufunc
+    for it.
+    """
+    x = np.asarray(x, dtype='float64')
+    t = 1 / (1 + 0.5 * np.abs(x))
+
+    # evaluate the polynomial in t with Horner's rule
+    poly = np.full(x.shape, ERFC_COEFFICIENTS[-1])
+    for coefficient in ERFC_COEFFICIENTS[-2::-1]:
+        poly = poly * t + coefficient
+    value = t * np.exp(-x * x + poly)
+
+    return np.where(x >= 0, value, 2 - value)
+
+def z_quantile(level):
+    """
+    This function returns the normal quantile of a two-sided interval at `level` (1.96 for 0.95).
+    """
+    return NormalDist().inv_cdf(0.5 + level / 2)
+
+def proportions(successes, trials):
+    """
+    This function returns the proportions `successes / trials` as floats, NaN where there are no trials.
+    """
+    successes = np.asarray(successes, dtype='float64')
+    trials = np.asarray(trials, dtype='float64')
+    return np.divide(successes, trials, out=np.full(np.broadcast(successes, trials).shape, np.nan), where=trials > 0)
+
+def wilson_interval(successes, trials, level=0.95):
+    """
+    This function returns the lower and upper bounds of the Wilson score interval at `level` of the proportion of
+    every cell of `successes` out of `trials` (arrays of any shape), NaN for cells without trials.
+    """
+    z = z_quantile(level)
+    n = np.asarray(trials, dtype='float64')
+    p = proportions(successes, trials)
+
+    # the interval is centered on the proportion shrunk towards 1/2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = 1 + z * z / n
+        center = (p + z * z / (2 * n)) / denominator
+        half = z * np.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+
+    return center - half, center + half
+
+def clopper_pearson_interval(successes, trials, level=0.95):
+    """
+    This function returns the lower and upper bounds of the exact (Clopper-Pearson) interval at `level` of the
+    proportion of every cell of `successes` out of `trials`, NaN for cells without trials.
+    The beta quantiles come from scipy, which is only needed by this function.
+    """
+    try:
+        from scipy.special import betaincinv
+    except ImportError as error:
+        raise ImportError('clopper_pearson_interval needs scipy, use wilson_interval without it') from error
+
+    k = np.asarray(successes, dtype='float64')
+    n = np.asarray(trials, dtype='float64')
+    alpha = 1 - level
+
+    # the bounds are beta quantiles, fixed at 0 and 1 when there are no successes or no failures
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lower = np.where(k > 0, betaincinv(np.maximum(k, 1), np.maximum(n - k + 1, 1), alpha / 2), 0.0)
+        upper = np.where(k < n, betaincinv(k + 1, np.maximum(n - k, 1), 1 - alpha / 2), 1.0)
+    empty = n <= 0
+
+    return np.where(empty, np.nan, lower), np.where(empty, np.nan, upper)
+
+def two_proportion_test(successes_a, trials_a, successes_b, trials_b):
+    """
+    This function compares the proportions a and b of every cell with the pooled two-proportion z test (the same
+    test as the chi-square test of the 2x2 table, without continuity correction).
+    Returns the z statistics, the chi-square statistics (z squared, 1 degree of freedom) and the two-sided p-values,
+    NaN where a side has no trials or the pooled proportion is 0 or 1.
+    """
+    n_a = np.asarray(trials_a, dtype='float64')
+    n_b = np.asarray(trials_b, dtype='float64')
+    pooled = proportions(np.add(successes_a, successes_b), n_a + n_b)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        se = np.sqrt(pooled * (1 - pooled) * (1 / n_a + 1 / n_b))
+        z = (proportions(successes_a, n_a) - proportions(successes_b, n_b)) / se
+    z = np.where(np.isfinite(z), z, np.nan)
+
+    return z, z * z, erfc(np.abs(z) / np.sqrt(2))
+
+def benjamini_hochberg(p_values):
+    """
+    This function returns the Benjamini-Hochberg adjusted p-values (q-values) of `p_values` (an array of any shape),
+    which bound the false discovery rate when many cells are tested at once. NaN p-values are left out.
+    """
+    p_values = np.asarray(p_values, dtype='float64')
+    q_values = np.full(p_values.shape, np.nan)
+    valid = ~np.isnan(p_values)
+    p = p_values[valid]
+
+    # scale the sorted p-values by their rank and make them monotonic from the largest one down
+    order = np.argsort(p)
+    scaled = p[order] * len(p) / np.arange(1, len(p) + 1)
+    adjusted = np.empty(len(p))
+    adjusted[order] = np.minimum(np.minimum.accumulate(scaled[::-1])[::-1], 1)
+    q_values[valid] = adjusted
+
+    return q_values
+
+def click_rate_tests(df, by, level=0.95, interval='wilson'):
+    """
+    This function takes a pandas DataFrame (`df`) or a click cube (see `functions_click.click_cube`) and tests
+    every `by` ('Income_Range' or 'Age_Range') x interest category cell at once.
+    For each cell it returns the clicks, the impressions, the click rate and its `interval` ('wilson' or
+    'clopper-pearson') at `level`, the click rate of the other categories of the same range, the difference, the
+    statistics and p-value of the two-proportion test of the cell against them, and the Benjamini-Hochberg q-value
+    over all the cells. Rates are proportions (0 to 1).
+    """
+    cube = df if isinstance(df, np.ndarray) else click_cube(df)
+    counts, labels = cube_rollup(cube, by)
+
+    # clicks and impressions of each cell and of the rest of its range
+    clicks = counts[..., 1]
+    impressions = counts.sum(axis=-1)
+    rest_clicks = clicks.sum(axis=1, keepdims=True) - clicks
+    rest_impressions = impressions.sum(axis=1, keepdims=True) - impressions
+
+    if interval == 'wilson':
+        lower, upper = wilson_interval(clicks, impressions, level)
+    elif interval == 'clopper-pearson':
+        lower, upper = clopper_pearson_interval(clicks, impressions, level)
+    else:
+        raise ValueError(f"Unknown interval: {interval!r}, expected 'wilson' or 'clopper-pearson'")
+    z, chi2, p_value = two_proportion_test(clicks, impressions, rest_clicks, rest_impressions)
+    rate = proportions(clicks, impressions)
+    rest_rate = proportions(rest_clicks, rest_impressions)
+
+    index = pd.MultiIndex.from_product([labels, INTEREST_CATEGORIES], names=[by, 'Interest_Category'])
+    return pd.DataFrame({
+        'clicks': clicks.ravel(),
+        'impressions': impressions.ravel(),
+        'rate': rate.ravel(),
+        'lower': lower.ravel(),
+        'upper': upper.ravel(),
+        'rest_rate': rest_rate.ravel(),
+        'difference': (rate - rest_rate).ravel(),
+        'z': z.ravel(),
+        'chi2': chi2.ravel(),
+        'p_value': p_value.ravel(),
+        'q_value': benjamini_hochberg(p_value).ravel(),
+    }, index=index)
+
+def bootstrap_click_rates(df, by, n_boot=1000, level=0.95, random_state=0):
+    """
+    This function takes a pandas DataFrame (`df`) or a click cube and bootstraps the click rate of every `by` x
+    interest category cell and its difference with the other categories of the same range. Resampling the rows
+    with replacement is the same as drawing the counts of all the cells from a multinomial with the observed
+    shares, so each of the `n_boot` resamples is one multinomial draw of the cell counts, all drawn at once.
+    Returns a DataFrame with the percentile intervals at `level` of the rate and of the difference, and the
+    two-sided bootstrap p-value of the difference. Memory grows with `n_boot` x the number of cells.
+    """
+    cube = df if isinstance(df, np.ndarray) else click_cube(df)
+    counts, labels = cube_rollup(cube, by)
+
+    # draw the counts of every cell and click status for all the resamples
+    total = counts.sum()
+    rng = np.random.default_rng(random_state)
+    draws = rng.multinomial(total, counts.ravel() / total, size=n_boot).reshape((n_boot,) + counts.shape)
+
+    # rates of each cell and of the rest of its range in every resample
+    clicks = draws[..., 1]
+    impressions = draws.sum(axis=-1)
+    rate = proportions(clicks, impressions)
+    difference = rate - proportions(clicks.sum(axis=2, keepdims=True) - clicks,
+                                    impressions.sum(axis=2, keepdims=True) - impressions)
+
+    # percentile intervals and the share of resamples on each side of no difference
+    bounds = [(1 - level) / 2, (1 + level) / 2]
+    rate_bounds = np.nanquantile(rate, bounds, axis=0)
+    difference_bounds = np.nanquantile(difference, bounds, axis=0)
+    p_boot = np.minimum(2 * np.minimum((difference <= 0).mean(axis=0), (difference >= 0).mean(axis=0)), 1)
+
+    index = pd.MultiIndex.from_product([labels, INTEREST_CATEGORIES], names=[by, 'Interest_Category'])
+    return pd.DataFrame({
+        'rate_lower': rate_bounds[0].ravel(),
+        'rate_upper': rate_bounds[1].ravel(),
+        'difference_lower': difference_bounds[0].ravel(),
+        'difference_upper': difference_bounds[1].ravel(),
+        'p_boot': p_boot.ravel(),
+    }, index=index)
@@ -0,0 +1,206 @@
+import atexit
+import functools
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+import pandas as pd
+
+# environment variable that enables the tracing at import and names the JSON lines file written at exit
+TRACE_ENV = 'REPORT_TRACE'
+
+# state of the tracing, the decorated functions only check TRACING when it is disabled
+TRACING = False
+TRACE_MEMORY = False
+STARTED_TRACEMALLOC = False
+
+# finished spans (dicts) and open spans (Span objects, innermost last)
+SPANS = []
+STACK = []
+
+
+def row_count(value):
+    """
+    This function returns the number of rows of a pandas DataFrame or Series, or the total over a tuple or list of
+    them (e.g. the three frames of `clean_df_product`), and None for anything else.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, (tuple, list)) and value and all(isinstance(item, (pd.DataFrame, pd.Series)) for item in value):
+        return sum(len(item) for item in value)
+    return None
+
+class Span:
+    """
+    A traced step: records its wall time, the time spent outside its child spans, the peak of traced memory above
+    the memory at its start and its input and output row counts (`rows_out` can be set inside the block).
+    """
+
+    def __init__(self, name, kind='step', rows_in=None):
+        self.name = name
+        self.kind = kind
+        self.rows_in = rows_in
+        self.rows_out = None
+
+    def __enter__(self):
+        self.parent = STACK[-1] if STACK else None
+        self.id = len(SPANS) + len(STACK)
+        self.children = 0.0
+
+        if TRACE_MEMORY:
+            # the peak is global, hand the peak so far to the parent before resetting it
+            current, peak = tracemalloc.get_traced_memory()
+            if self.parent is not None:
+                self.parent.peak = max(self.parent.peak, peak)
+            tracemalloc.reset_peak()
+            self.start_memory, self.peak = current, current
+
+        STACK.append(self)
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.start
+        STACK.pop()
+
+        record = {
+            'id': self.id,
+            'parent': None if self.parent is None else self.parent.id,
+            'name': self.name,
+            'kind': self.kind,
+            'start': self.start_time,
+            'wall_ms': wall * 1000,
+            'self_ms': (wall - self.children) * 1000,
+            'peak_mb': None,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'pid': os.getpid(),
+        }
+
+        if TRACE_MEMORY:
+            peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            record['peak_mb'] = (peak - self.start_memory) / 2 ** 20
+            if self.parent is not None:
+                self.parent.peak = max(self.parent.peak, peak)
+
+        if self.parent is not None:
+            self.parent.children += wall
+        SPANS.append(record)
+        return False
+
+class NullSpan:
+    """
+    The span returned by `span` when the tracing is disabled: it records nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SPAN = NullSpan()
+
+def span(name, kind='step', rows_in=None):
+    """
+    This function returns a context manager that traces the block as the step `name` of `kind` ('load', 'clean',
+    'aggregate', 'render' or 'step') with `rows_in` input rows, e.g.
+    `with span('read_excel', 'load') as step: df = pd.read_excel(url); step.rows_out = len(df)`.
+    It does nothing when the tracing is disabled.
+    """
+    return Span(name, kind, rows_in) if TRACING else NULL_SPAN
+
+def traced(kind):
+    """
+    This function returns a decorator that traces every call of a function as a span of `kind`, with the rows of
+    its first argument as input and the rows of its result as output (see `row_count`).
+    When the tracing is disabled the call only costs a check of a flag.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACING:
+                return func(*args, **kwargs)
+            with Span(func.__name__, kind, row_count(args[0]) if args else None) as record:
+                result = func(*args, **kwargs)
+                record.rows_out = row_count(result)
+            return result
+        return wrapper
+    return decorator
+
+def enable_tracing(memory=True):
+    """
+    This function turns the tracing on. With `memory=True` the peak memory of each span is measured with
+    tracemalloc, which slows down allocations while it runs. Spans of worker processes are not collected.
+    """
+    global TRACING, TRACE_MEMORY, STARTED_TRACEMALLOC
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        STARTED_TRACEMALLOC = True
+    TRACE_MEMORY = memory
+    TRACING = True
+
+def disable_tracing():
+    """
+    This function turns the tracing off (the spans recorded so far are kept).
+    """
+    global TRACING, TRACE_MEMORY, STARTED_TRACEMALLOC
+    TRACING = False
+    TRACE_MEMORY = False
+    if STARTED_TRACEMALLOC:
+        tracemalloc.stop()
+        STARTED_TRACEMALLOC = False
+
+@contextmanager
+def tracing(memory=True):
+    """
+    This function returns a context manager that enables the tracing inside its block and yields the list of spans.
+    """
+    enable_tracing(memory)
+    try:
+        yield SPANS
+    finally:
+        disable_tracing()
+
+def clear_spans():
+    """
+    This function forgets the recorded spans.
+    """
+    SPANS.clear()
+
+def write_spans(path, spans=None):
+    """
+    This function writes the spans (the recorded ones by default) to `path` as JSON lines, one span per line.
+    """
+    spans = SPANS if spans is None else spans
+    with open(path, 'w') as f:
+        for record in spans:
+            f.write(json.dumps(record) + '\n')
+
+def trace_summary(spans=None):
+    """
+    This function returns a pandas DataFrame with one row per traced step (kind and name): the number of calls,
+    the total wall time and the time spent in the step itself (without its child spans) in milliseconds, the
+    largest peak memory in MB and the total input and output rows. Steps are sorted by their own time.
+    """
+    spans = SPANS if spans is None else spans
+    columns = ['kind', 'name', 'wall_ms', 'self_ms', 'peak_mb', 'rows_in', 'rows_out']
+    df = pd.DataFrame(spans, columns=columns).astype({'peak_mb': 'float64', 'rows_in': 'float64', 'rows_out': 'float64'})
+
+    summary = df.groupby(['kind', 'name']).agg(
+        calls=('wall_ms', 'size'),
+        wall_ms=('wall_ms', 'sum'),
+        self_ms=('self_ms', 'sum'),
+        peak_mb=('peak_mb', 'max'),
+        rows_in=('rows_in', lambda rows: rows.sum(min_count=1)),
+        rows_out=('rows_out', lambda rows: rows.sum(min_count=1)),
+    )
+
+    return summary.sort_values('self_ms', ascending=False)
+
+# trace the whole run when the environment variable names an output file
+if os.environ.get(TRACE_ENV):
+    enable_tracing()
+    atexit.register(write_spans, os.environ[TRACE_ENV])